@@ -0,0 +1,107 @@
+# autotune_module.py
+
+import os
+import sys
+import json
+import time
+import math
+import itertools
+from contextlib import nullcontext
+from segmentation_module import (count_input_frames, iter_batches, iter_input_frames, iter_segmented_batches,
+                                 iter_segmented_batches_parallel, segment_images, segmentation_pool,
+                                 warm_up_segmentation_pool)
+
+AUTOTUNE_CONFIG_PATH = "output/segmentation_autotune.json"
+
+# Calibration grid
+calibration_frames = 8
+batch_size_options = (1, 4, 8)
+workers_options = (1, 2, 4)
+
+def candidate_configs(cpu_count, batch_sizes=batch_size_options, workers=workers_options, n_frames=None):
+    """(batch_size, workers, torch_threads) combinations to try; threads split the cores between workers.
+
+    With n_frames, configs with fewer batches than workers (idle workers) are left out.
+    """
+    configs = []
+    for batch_size, n_workers in itertools.product(batch_sizes, workers):
+        if n_workers > cpu_count:
+            continue
+        if n_frames is not None and math.ceil(n_frames / batch_size) < n_workers:
+            continue
+        configs.append({"batch_size": batch_size, "workers": n_workers,
+                        "torch_threads": max(1, cpu_count // n_workers)})
+    return configs
+
+def autotune_segmentation(input_path_or_dir, config_path=AUTOTUNE_CONFIG_PATH, n_frames=calibration_frames,
+                          batch_sizes=batch_size_options, workers=workers_options, channel=None,
+                          normalization="frame", **segment_kwargs):
+    """Time segmentation of the first n_frames frames under each candidate config and save the fastest.
+
+    The frames are read once, up front, and every config segments the same in-memory frames,
+    so only segmentation is timed: a parallel config's pool is started, and its model loaded
+    in every worker, before its timer starts. segment_kwargs go to segment_images (model_type,
+    tile_size, downsample, ...); there is no mask cache. Nothing is written besides the config file.
+    """
+    cpu_count = os.cpu_count() or 1
+    positions = list(range(min(n_frames, count_input_frames(input_path_or_dir))))
+    if not positions:
+        raise ValueError(f"No frames found for calibration in: {input_path_or_dir}")
+    frames = [img for _, img in iter_input_frames(input_path_or_dir, channel=channel, normalization=normalization,
+                                                   positions=positions)]
+
+    # Warm-up: loads the model in this process so the first serial config is not penalized
+    segment_images(frames[:1], **segment_kwargs)
+
+    configs = candidate_configs(cpu_count, batch_sizes, workers, len(frames))
+    if not configs:
+        raise ValueError(f"No candidate configs for {len(frames)} frames and workers {workers}")
+    measurements = []
+    for config in configs:
+        batches = list(iter_batches(enumerate(frames), config["batch_size"]))
+        n_workers, threads = config["workers"], config["torch_threads"]
+        with segmentation_pool(n_workers, threads, **segment_kwargs) if n_workers > 1 else nullcontext() as executor:
+            if executor is not None:
+                warm_up_segmentation_pool(executor, n_workers, frames[0])
+                segmented = iter_segmented_batches_parallel(batches, n_workers, executor=executor)
+            else:
+                segmented = iter_segmented_batches(batches, 1, threads, **segment_kwargs)
+            start = time.perf_counter()
+            for _ in segmented:
+                pass
+            elapsed = time.perf_counter() - start
+        measurements.append(dict(config, frames_per_second=len(frames) / elapsed))
+        print(f"[Autotune] batch_size={config['batch_size']} workers={config['workers']} "
+              f"torch_threads={config['torch_threads']}: {measurements[-1]['frames_per_second']:.2f} frames/s")
+
+    best = max(measurements, key=lambda m: m["frames_per_second"])
+    result = {
+        "batch_size": best["batch_size"],
+        "workers": best["workers"],
+        "torch_threads": best["torch_threads"],
+        "frames_per_second": best["frames_per_second"],
+        "cpu_count": cpu_count,
+        "calibration_frames": len(frames),
+        "measurements": measurements,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    os.makedirs(os.path.dirname(config_path) or ".", exist_ok=True)
+    with open(config_path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"[Autotune] Saved best config to {config_path}: batch_size={best['batch_size']} "
+          f"workers={best['workers']} torch_threads={best['torch_threads']}")
+    return result
+
+def load_autotune_config(config_path=AUTOTUNE_CONFIG_PATH):
+    """Return the saved autotune result, or None if none exists or it was measured on a different core count."""
+    if not os.path.exists(config_path):
+        return None
+    with open(config_path) as f:
+        config = json.load(f)
+    if config.get("cpu_count") != (os.cpu_count() or 1):
+        print(f"[Autotune] Ignoring {config_path}: calibrated for {config.get('cpu_count')} cores")
+        return None
+    return config
+
+if __name__ == "__main__":
+    autotune_segmentation(sys.argv[1] if len(sys.argv) > 1 else "input")
@@ -0,0 +1,173 @@
+# chunked_tracking_module.py
+
+import os
+import tempfile
+from functools import partial
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from segmentation_module import MaskStackFile
+from process_pool_module import bounded_map, spawn_pool
+from lap_tracker_module import track_spots, summarize_tracks
+from spot_detection_module import detect_spots
+import tracking_module
+from tracking_module import (resolve_mask_paths, run_trackmate, export_tracking_results, spots_csv_name,
+                             tracks_csv_name, edges_csv_name)
+
+# Defaults for tracking long movies in pieces
+window_frames = 200  # Frames tracked together
+window_overlap = 20  # Frames shared by consecutive windows, used to join their tracks
+stitch_max_distance = 2.0  # Same cell in both windows: same frame, centroids at most this far apart
+
+def time_windows(n_frames, window=window_frames, overlap=window_overlap):
+    """Return (start, stop) frame ranges of length window that overlap by overlap frames and cover n_frames."""
+    if overlap >= window:
+        raise ValueError(f"overlap ({overlap}) must be smaller than window ({window})")
+    windows = []
+    start = 0
+    while True:
+        stop = min(start + window, n_frames)
+        windows.append((start, stop))
+        if stop >= n_frames:
+            return windows
+        start = stop - overlap
+
+def _track_window_python(masks, linker):
+    # One window with the Python backend; runs in a worker process when windows are tracked in parallel.
+    # linker holds the parent's settings: a spawned worker would see only tracking_module's defaults
+    return track_spots(detect_spots(masks), **linker)
+
+def _track_window_trackmate(masks, session):
+    with tempfile.TemporaryDirectory() as window_dir:
+        if isinstance(masks, list):
+            run_trackmate(None, window_dir, session, mask_paths=masks)
+        else:
+            run_trackmate(None, window_dir, session, mask_stack=masks)
+        return (pd.read_csv(os.path.join(window_dir, spots_csv_name)),
+                pd.read_csv(os.path.join(window_dir, tracks_csv_name)),
+                pd.read_csv(os.path.join(window_dir, edges_csv_name)))
+
+def stitch_windows(window_results, windows):
+    """Join per-window (spots, tracks, edges) results into one spots, tracks and edges table.
+
+    Window spots are shifted to movie frames. In every overlap, spots of the two windows in
+    the same frame within stitch_max_distance (mutual nearest neighbours) are the same cell.
+    Each overlap frame is kept from one window only: the first half from the earlier window,
+    the rest from the later one. A link that leaves its window's half is redirected to the
+    matching spot of the next window, which also joins the two windows' tracks.
+    """
+    shifted_spots = []
+    for index, ((start, stop), (spots, _, _)) in enumerate(zip(windows, window_results)):
+        spots = spots.copy()
+        frame_interval = 1.0
+        moving = spots[spots["FRAME"] > 0]
+        if len(moving):
+            frame_interval = float(moving["POSITION_T"].iloc[0] / moving["FRAME"].iloc[0])
+        spots["FRAME"] = spots["FRAME"].astype(int) + start
+        spots["POSITION_T"] = spots["POSITION_T"] + start * frame_interval
+        shifted_spots.append(spots)
+
+    # Cut frame between window index - 1 and index: the middle of their overlap
+    cuts = [(windows[index][0] + windows[index - 1][1]) // 2 for index in range(1, len(windows))]
+
+    kept_spots, global_ids, next_window_match = [], {}, {}
+    for index, spots in enumerate(shifted_spots):
+        keep_from = cuts[index - 1] if index > 0 else windows[index][0]
+        keep_until = cuts[index] if index + 1 < len(windows) else windows[index][1]
+        if index > 0:
+            previous = shifted_spots[index - 1]
+            for frame in range(windows[index][0], windows[index - 1][1]):
+                a = previous[previous["FRAME"] == frame]
+                b = spots[spots["FRAME"] == frame]
+                if len(a) == 0 or len(b) == 0:
+                    continue
+                a_xy, b_xy = a[["POSITION_X", "POSITION_Y"]].to_numpy(), b[["POSITION_X", "POSITION_Y"]].to_numpy()
+                distance, b_nearest = cKDTree(b_xy).query(a_xy)
+                _, a_nearest = cKDTree(a_xy).query(b_xy)
+                for a_idx, (d, b_idx) in enumerate(zip(distance, b_nearest)):
+                    if d <= stitch_max_distance and a_nearest[b_idx] == a_idx:
+                        next_window_match[(index - 1, int(a["ID"].iloc[a_idx]))] = int(b["ID"].iloc[b_idx])
+        kept = spots[(spots["FRAME"] >= keep_from) & (spots["FRAME"] < keep_until)]
+        for spot_id in kept["ID"]:
+            global_ids[(index, int(spot_id))] = len(global_ids)
+        kept_spots.append(kept.assign(ID=[global_ids[(index, int(spot_id))] for spot_id in kept["ID"]]))
+
+    def global_spot(window, spot_id):
+        # Follow the spot into later windows until the one that kept it
+        while (window, spot_id) not in global_ids:
+            if (window, spot_id) not in next_window_match:
+                return None
+            spot_id = next_window_match[(window, spot_id)]
+            window += 1
+        return global_ids[(window, spot_id)]
+
+    edge_rows = []
+    for index, (_, _, edges) in enumerate(window_results):
+        for source, target, cost in zip(edges["SPOT_SOURCE_ID"], edges["SPOT_TARGET_ID"], edges["LINK_COST"]):
+            if (index, int(source)) not in global_ids:
+                continue  # This link belongs to the neighbouring window's half of the overlap
+            target_id = global_spot(index, int(target))
+            if target_id is not None:
+                edge_rows.append((global_ids[(index, int(source))], target_id, cost))
+    edges = pd.DataFrame(edge_rows, columns=["SPOT_SOURCE_ID", "SPOT_TARGET_ID", "LINK_COST"]).astype(
+        {"SPOT_SOURCE_ID": int, "SPOT_TARGET_ID": int, "LINK_COST": float})  # Typed even without links
+
+    spots = pd.concat(kept_spots, ignore_index=True)
+    n_spots = len(spots)
+    graph = csr_matrix((np.ones(len(edges)), (edges["SPOT_SOURCE_ID"], edges["SPOT_TARGET_ID"])), shape=(n_spots, n_spots))
+    _, component = connected_components(graph, directed=False)
+    linked = np.zeros(n_spots, bool)
+    linked[edges["SPOT_SOURCE_ID"]] = True
+    linked[edges["SPOT_TARGET_ID"]] = True
+
+    # IDs equal row positions here; number the joined tracks 0..N-1 in order of their first spot
+    spots = spots.assign(TRACK_ID=component)[linked].sort_values(["FRAME", "ID"])
+    track_ids = {component_id: track_id for track_id, component_id in enumerate(spots["TRACK_ID"].unique())}
+    spots["TRACK_ID"] = spots["TRACK_ID"].map(track_ids)
+    edges["TRACK_ID"] = pd.Series(component[edges["SPOT_SOURCE_ID"].to_numpy()]).map(track_ids).to_numpy()
+    return spots.sort_values(["TRACK_ID", "FRAME", "ID"]), summarize_tracks(spots, edges), edges
+
+def run_chunked_tracking(sequence_dir, output_dir, window=window_frames, overlap=window_overlap,
+                         backend="trackmate", session=None, mask_stack=None, mask_stack_path=None,
+                         mask_paths=None, workers=1):
+    """Track a long movie as overlapping time windows and stitch the windows' tracks together.
+
+    Takes the same mask inputs as run_trackmate and writes the same CSV files.
+    Only one window of masks is loaded at a time (per worker), so memory, including the
+    TrackMate model in the JVM, depends on the window size rather than the movie length.
+    With the "python" backend, workers > 1 tracks windows in a process pool. Keep overlap
+    above max_frame_gap so a gap near a window edge is still closed inside one window.
+    """
+    if backend not in tracking_module.tracking_backends:
+        raise ValueError(f"Unknown tracking backend: {backend} (expected one of {tracking_module.tracking_backends})")
+    mask_paths = resolve_mask_paths(sequence_dir, mask_stack, mask_stack_path, mask_paths)
+    stack_file = MaskStackFile(mask_stack_path) if mask_stack is None and mask_paths is None else None
+    try:
+        n_frames = len(mask_paths if mask_paths is not None else mask_stack if mask_stack is not None else stack_file)
+        windows = time_windows(n_frames, window, overlap)
+        print(f"[Tracking] Tracking {n_frames} frames in {len(windows)} windows of {window} frames")
+
+        def window_masks(start, stop):
+            if mask_paths is not None:
+                return mask_paths[start:stop]
+            if mask_stack is not None:
+                return np.asarray(mask_stack[start:stop])
+            return np.stack([stack_file[idx] for idx in range(start, stop)])
+
+        track_window = partial(_track_window_python, linker=tracking_module.linker_settings())
+        if backend == "python" and workers > 1:
+            with spawn_pool(workers) as executor:
+                # At most 2 * workers windows of masks are held at once
+                window_results = list(bounded_map(executor, track_window,
+                                                  (window_masks(start, stop) for start, stop in windows), workers))
+        elif backend == "python":
+            window_results = [track_window(window_masks(start, stop)) for start, stop in windows]
+        else:
+            window_results = [_track_window_trackmate(window_masks(start, stop), session) for start, stop in windows]
+    finally:
+        if stack_file is not None:
+            stack_file.close()
+
+    export_tracking_results(*stitch_windows(window_results, windows), output_dir)
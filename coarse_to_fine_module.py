@@ -0,0 +1,100 @@
+# coarse_to_fine_module.py
+
+import os
+import numpy as np
+import pandas as pd
+from segmentation_module import (count_input_frames, discard_manifest, input_intensity_limits, segment_frames,
+                                 write_label_mask, ensure_directory_exists)
+from tracking_module import run_tracking, spots_csv_name, tracks_csv_name, tracking_backends
+from post_tracking_module import detect_mitosis
+
+# Defaults for the cheap first pass
+coarse_frame_step = 4  # Segment every k-th frame
+coarse_downsample = 2.0  # ...at this reduced resolution
+
+def find_mitosis_candidate_frames(tracking_csv_dir, frame_positions, margin, n_frames):
+    """Return the sorted input frame indices within margin of a possible division in the coarse tracks.
+
+    A track is a candidate if TrackMate reports a split or detect_mitosis fires on it; the
+    windows are centred on the coarse frames where its cell count goes up. frame_positions maps
+    coarse FRAME values back to input frame indices.
+    """
+    tracks_df = pd.read_csv(os.path.join(tracking_csv_dir, tracks_csv_name))
+    spots_df = pd.read_csv(os.path.join(tracking_csv_dir, spots_csv_name))
+    spots_df['ELLIPSE_ASPECTRATIO'] = pd.to_numeric(spots_df['ELLIPSE_ASPECTRATIO'], errors='coerce')
+    merged_df = pd.merge(spots_df, tracks_df, on='TRACK_ID', how='left')
+
+    candidates = set()
+    for track_id, group in merged_df.groupby('TRACK_ID'):
+        group = group.sort_values(by='FRAME')
+        if not (group['NUMBER_SPLITS'].max() > 0 or detect_mitosis(group)):
+            continue
+
+        cells_per_frame = group.groupby('FRAME').size()
+        split_frames = cells_per_frame.index[cells_per_frame.diff() > 0]
+        if len(split_frames) == 0:
+            split_frames = cells_per_frame.index[cells_per_frame > 1][:1]
+
+        for frame in split_frames:
+            center = frame_positions[int(frame)]
+            candidates.update(range(max(0, center - margin), min(n_frames, center + margin + 1)))
+
+    return sorted(candidates)
+
+def segment_coarse_to_fine(input_path_or_dir, output_dir, work_dir, frame_step=coarse_frame_step,
+                           downsample=coarse_downsample, margin=None, session=None, backend="trackmate",
+                           **segment_kwargs):
+    """Segment a movie in two passes, spending full-resolution segmentation only around divisions.
+
+    1. Every frame_step-th frame is segmented at 1/downsample resolution and tracked.
+    2. Windows of +/- margin frames (default 3 * frame_step) around candidate divisions are
+       re-segmented at full temporal and spatial resolution.
+
+    frame_N_mask.tif is written for every frame: the fine mask inside a window, the coarse
+    mask on coarse frames, and an empty mask elsewhere (bridged by the tracker's gap closing
+    while frame_step - 1 <= max_frame_gap). Returns the fine-pass frame indices. The output
+    directory's segmentation manifest is discarded, so a later segment_frames run redoes every frame.
+    The coarse tracks come from the same backend as the final tracking ("python" needs no JVM).
+    segment_kwargs are passed on to both segment_frames calls. With "global" or "rolling"
+    normalization both passes use limits computed over the whole stack, as a full run would.
+    """
+    if backend not in tracking_backends:
+        raise ValueError(f"Unknown tracking backend: {backend} (expected one of {tracking_backends})")
+    ensure_directory_exists(output_dir)
+    if margin is None:
+        margin = 3 * frame_step
+    n_frames = count_input_frames(input_path_or_dir)
+    if segment_kwargs.get("intensity_limits") is None:
+        normalization_kwargs = {name: segment_kwargs[name] for name in
+                                ("channel", "normalization", "percentiles", "rolling_window") if name in segment_kwargs}
+        segment_kwargs["intensity_limits"] = input_intensity_limits(input_path_or_dir, **normalization_kwargs)
+
+    print(f"[Coarse-to-fine] Pass 1: every {frame_step}th of {n_frames} frames at 1/{downsample} resolution")
+    coarse_positions = list(range(0, n_frames, frame_step))
+    coarse_stack = segment_frames(input_path_or_dir, output_dir, write_intermediates=False, return_masks=True,
+                                  frame_indices=coarse_positions, downsample=downsample, **segment_kwargs)
+    if coarse_stack is None:
+        print("[Coarse-to-fine] No frames found. Nothing to segment.")
+        return []
+
+    coarse_csv_dir = os.path.join(work_dir, "coarse_tracking_csv")
+    run_tracking(None, coarse_csv_dir, session, mask_stack=coarse_stack, backend=backend)
+    fine_positions = find_mitosis_candidate_frames(coarse_csv_dir, coarse_positions, margin, n_frames)
+
+    print(f"[Coarse-to-fine] Pass 2: {len(fine_positions)} of {n_frames} frames near candidate divisions")
+    fine_masks = {}
+    if fine_positions:
+        fine_stack = segment_frames(input_path_or_dir, output_dir, write_intermediates=False, return_masks=True,
+                                    frame_indices=fine_positions, **segment_kwargs)
+        fine_masks = dict(zip(fine_positions, fine_stack))
+    coarse_masks = dict(zip(coarse_positions, coarse_stack))
+
+    # The masks below were not segmented at full resolution, so a later segment_frames run
+    # must not resume from a manifest of an earlier run in this directory
+    discard_manifest(output_dir)
+    empty_mask = np.zeros(coarse_stack.shape[1:], dtype=coarse_stack.dtype)
+    for position in range(n_frames):
+        label_mask = fine_masks.get(position, coarse_masks.get(position, empty_mask))
+        write_label_mask(label_mask, position + 1, output_dir)
+
+    return fine_positions
@@ -0,0 +1,159 @@
+# lap_tracker_module.py
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, min_weight_full_bipartite_matching
+
+# LAP cost settings, matching the TrackMate SPARSE_LAP_TRACKER configuration in tracking_module
+alternative_linking_cost_factor = 1.05
+cutoff_percentile = 0.9
+
+def candidate_pairs(source_xy, target_xy, max_distance):
+    """Return (source index, target index, squared distance) for all pairs within max_distance (KD-tree pruned)."""
+    if len(source_xy) == 0 or len(target_xy) == 0:
+        return np.zeros(0, int), np.zeros(0, int), np.zeros(0)
+    pairs = cKDTree(source_xy).sparse_distance_matrix(cKDTree(target_xy), max_distance, output_type="ndarray")
+    return pairs["i"].astype(int), pairs["j"].astype(int), pairs["v"] ** 2
+
+def solve_lap(rows, cols, costs, n_rows, n_cols, alternative_cost):
+    """Return the indices of the candidate links (rows[k], cols[k], costs[k]) kept by the optimal assignment.
+
+    Uses the block formulation of Jaqaman et al. (2008), as TrackMate does: every row and
+    column may instead take a "no link" at alternative_cost, and the auxiliary lower-right
+    block (the transposed candidates) keeps the square matrix perfectly matchable. The
+    matrix stays sparse, so only the KD-tree candidates are ever considered.
+    """
+    if len(costs) == 0:
+        return np.zeros(0, int)
+    n_links = len(costs)
+    # Spots that did not move link at zero cost, which alternative_cost (a multiple of the
+    # costs) would tie; a small floor keeps such links cheaper than leaving both spots unlinked
+    alternative_cost = max(alternative_cost, 1e-6)
+    row_range, col_range = np.arange(n_rows), np.arange(n_cols)
+    matrix_rows = np.concatenate([rows, row_range, n_rows + col_range, n_rows + cols])
+    matrix_cols = np.concatenate([cols, n_cols + row_range, col_range, n_cols + rows])
+    weights = np.concatenate([costs, np.full(n_rows, alternative_cost), np.full(n_cols, alternative_cost),
+                              np.full(n_links, costs.min())])
+    # +1 keeps every weight positive (a zero distance is still an edge); all perfect
+    # matchings have the same number of edges, so the optimum is unchanged
+    size = n_rows + n_cols
+    matrix = csr_matrix((weights + 1.0, (matrix_rows, matrix_cols)), shape=(size, size))
+    matched_rows, matched_cols = min_weight_full_bipartite_matching(matrix)
+
+    linked = (matched_rows < n_rows) & (matched_cols < n_cols)
+    if not linked.any():
+        return np.zeros(0, int)
+    link_index = csr_matrix((np.arange(1, n_links + 1), (rows, cols)), shape=(n_rows, n_cols))
+    return np.asarray(link_index[matched_rows[linked], matched_cols[linked]]).ravel() - 1
+
+def link_frame_to_frame(spots, linking_max_distance):
+    """Link spots in consecutive frames; returns (source row, target row, cost) arrays."""
+    sources, targets, link_costs = [], [], []
+    xy = spots[["POSITION_X", "POSITION_Y"]].to_numpy()
+    frame_index = {frame: np.flatnonzero(spots["FRAME"].to_numpy() == frame) for frame in spots["FRAME"].unique()}
+    for frame, source_idx in frame_index.items():
+        target_idx = frame_index.get(frame + 1)
+        if target_idx is None:
+            continue
+        rows, cols, costs = candidate_pairs(xy[source_idx], xy[target_idx], linking_max_distance)
+        if len(costs) == 0:
+            continue
+        kept = solve_lap(rows, cols, costs, len(source_idx), len(target_idx),
+                         alternative_linking_cost_factor * costs.max())
+        sources.append(source_idx[rows[kept]])
+        targets.append(target_idx[cols[kept]])
+        link_costs.append(costs[kept])
+    if not sources:
+        return np.zeros(0, int), np.zeros(0, int), np.zeros(0)
+    return np.concatenate(sources), np.concatenate(targets), np.concatenate(link_costs)
+
+def close_gaps_and_splits(spots, sources, targets, gap_closing_max_distance, max_frame_gap, splitting_max_distance):
+    """Second LAP over track segments: bridge gaps of up to max_frame_gap frames and add divisions.
+
+    Rows are segment ends (gap closing) and spots inside a segment (splitting); columns are
+    segment starts. Returns the extra (source, target, cost) links.
+    """
+    n_spots = len(spots)
+    xy = spots[["POSITION_X", "POSITION_Y"]].to_numpy()
+    frames = spots["FRAME"].to_numpy()
+    has_successor = np.zeros(n_spots, bool)
+    has_successor[sources] = True
+    has_predecessor = np.zeros(n_spots, bool)
+    has_predecessor[targets] = True
+    ends = np.flatnonzero(~has_successor)
+    middles = np.flatnonzero(has_successor)
+    starts = np.flatnonzero(~has_predecessor)
+
+    # Gap closing: end at t to a start at t + 2 .. t + max_frame_gap
+    gap_rows, gap_cols, gap_costs = candidate_pairs(xy[ends], xy[starts], gap_closing_max_distance)
+    frame_gap = frames[starts[gap_cols]] - frames[ends[gap_rows]]
+    keep = (frame_gap >= 2) & (frame_gap <= max_frame_gap)
+    gap_rows, gap_cols, gap_costs = gap_rows[keep], gap_cols[keep], gap_costs[keep]
+
+    # Splitting: a spot that continues its segment at t also starts another segment at t + 1
+    split_rows, split_cols, split_costs = candidate_pairs(xy[middles], xy[starts], splitting_max_distance)
+    keep = frames[starts[split_cols]] - frames[middles[split_rows]] == 1
+    split_rows, split_cols, split_costs = split_rows[keep], split_cols[keep], split_costs[keep]
+
+    row_spots = np.concatenate([ends, middles])
+    rows = np.concatenate([gap_rows, len(ends) + split_rows])
+    cols = np.concatenate([gap_cols, split_cols])
+    costs = np.concatenate([gap_costs, split_costs])
+    if len(costs) == 0:
+        return np.zeros(0, int), np.zeros(0, int), np.zeros(0)
+    alternative_cost = alternative_linking_cost_factor * np.percentile(costs, 100 * cutoff_percentile)
+    kept = solve_lap(rows, cols, costs, len(row_spots), len(starts), alternative_cost)
+    return row_spots[rows[kept]], starts[cols[kept]], costs[kept]
+
+def summarize_tracks(spots, edges):
+    """Return the tracks table (TrackMate's tracks.csv columns) for spots with TRACK_ID and their edges."""
+    spots = spots.sort_values(["FRAME", "ID"])
+    out_degree = edges["SPOT_SOURCE_ID"].value_counts()
+    in_degree = edges["SPOT_TARGET_ID"].value_counts()
+    by_track = spots.assign(IS_SPLIT=spots["ID"].map(out_degree).fillna(0) > 1,
+                            IS_MERGE=spots["ID"].map(in_degree).fillna(0) > 1).groupby("TRACK_ID")
+    tracks = by_track.agg(NUMBER_SPOTS=("ID", "size"), NUMBER_SPLITS=("IS_SPLIT", "sum"),
+                          NUMBER_MERGES=("IS_MERGE", "sum"))
+    first = by_track[["POSITION_X", "POSITION_Y"]].first()
+    last = by_track[["POSITION_X", "POSITION_Y"]].last()
+    tracks["TRACK_DISPLACEMENT"] = np.hypot(last["POSITION_X"] - first["POSITION_X"],
+                                            last["POSITION_Y"] - first["POSITION_Y"])
+    return tracks.reset_index()
+
+def build_tracks(spots, sources, targets, costs):
+    """Group linked spots into tracks; returns (spots with TRACK_ID, tracks, edges) in TrackMate's CSV schema.
+
+    sources / targets are row positions in spots. As in TrackMate, spots without any link do
+    not belong to a track and are dropped.
+    """
+    n_spots = len(spots)
+    all_ids = spots["ID"].to_numpy()
+    graph = csr_matrix((np.ones(len(sources)), (sources, targets)), shape=(n_spots, n_spots))
+    _, component = connected_components(graph, directed=False)
+    linked = np.zeros(n_spots, bool)
+    linked[sources] = True
+    linked[targets] = True
+
+    spots = spots.assign(TRACK_ID=component)[linked]
+    spots = spots.sort_values(["FRAME", "ID"])
+    # Number tracks 0..N-1 in order of their first spot
+    track_ids = {component_id: track_id for track_id, component_id in enumerate(spots["TRACK_ID"].unique())}
+    spots["TRACK_ID"] = spots["TRACK_ID"].map(track_ids)
+
+    edges = pd.DataFrame({
+        "SPOT_SOURCE_ID": all_ids[sources],
+        "SPOT_TARGET_ID": all_ids[targets],
+        "LINK_COST": costs,
+        "TRACK_ID": pd.Series(component[sources]).map(track_ids).to_numpy(),
+    })
+    return spots.sort_values(["TRACK_ID", "FRAME", "ID"]), summarize_tracks(spots, edges), edges
+
+def track_spots(spots, linking_max_distance, gap_closing_max_distance, max_frame_gap, splitting_max_distance):
+    """Run the two LAP steps over detected spots; returns (spots, tracks, edges) DataFrames."""
+    sources, targets, costs = link_frame_to_frame(spots, linking_max_distance)
+    gap_sources, gap_targets, gap_costs = close_gaps_and_splits(spots, sources, targets, gap_closing_max_distance,
+                                                                max_frame_gap, splitting_max_distance)
+    return build_tracks(spots, np.concatenate([sources, gap_sources]), np.concatenate([targets, gap_targets]),
+                        np.concatenate([costs, gap_costs]))
@@ -0,0 +1,56 @@
+# model_weights_module.py
+
+import os
+import sys
+import shutil
+import hashlib
+from typing import Optional
+
+DEFAULT_MODEL_TYPE = 'livecell_cp3'
+
+# Local weight store: <dir>/<model_type> plus a <model_type>.sha256 checksum file
+MODEL_WEIGHTS_DIR = os.environ.get("MITOSIS_MODEL_WEIGHTS_DIR", "models")
+
+def model_weights_path(model_type: str, weights_dir: str = MODEL_WEIGHTS_DIR) -> str:
+    return os.path.join(weights_dir, model_type)
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def recorded_checksum(weights_path: str) -> Optional[str]:
+    """The checksum stored next to the weights, or None if there are no local weights."""
+    checksum_path = f"{weights_path}.sha256"
+    if not os.path.isfile(weights_path) or not os.path.exists(checksum_path):
+        return None
+    with open(checksum_path) as f:
+        return f.read().split()[0]
+
+def verify_model_weights(weights_path: str) -> None:
+    expected = recorded_checksum(weights_path)
+    if expected is None:
+        raise FileNotFoundError(f"Missing checksum for model weights: {weights_path}.sha256")
+    if file_sha256(weights_path) != expected:
+        raise ValueError(f"Checksum mismatch for model weights: {weights_path}")
+
+def install_model_weights(model_type: str = DEFAULT_MODEL_TYPE, weights_dir: str = MODEL_WEIGHTS_DIR) -> str:
+    """Copy Cellpose's weights for model_type into the local store and record their checksum.
+
+    Cellpose downloads the weights if they are not cached yet, so this needs network access
+    once (e.g. while building the Docker image); later runs load them offline.
+    """
+    from cellpose import models
+    os.makedirs(weights_dir, exist_ok=True)
+    weights_path = model_weights_path(model_type, weights_dir)
+    shutil.copyfile(models.model_path(model_type), weights_path)
+    with open(f"{weights_path}.sha256", "w") as f:
+        f.write(f"{file_sha256(weights_path)}  {model_type}\n")
+    print(f"[Segmentation] Installed model weights: {weights_path}")
+    return weights_path
+
+if __name__ == "__main__":
+    # Standalone so the Docker weights layer depends on this file only, not on the pipeline code
+    install_model_weights(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_MODEL_TYPE)
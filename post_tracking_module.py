@@ -1,9 +1,18 @@
 import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import re
+import threading
+from matplotlib.figure import Figure
 from PIL import Image
+from writer_module import submit_write
+
+# Matplotlib rendering is not thread-safe, so overlays saved by background writers render one at a time
+_figure_lock = threading.Lock()
+
+def save_figure(fig, output_path, **savefig_kwargs):
+    with _figure_lock:
+        fig.savefig(output_path, **savefig_kwargs)
 
 def detect_mitosis(group, overlap_threshold=3):  # Detect mitosis events based on distance and overlap threshold.
     frame_groups = group.groupby('FRAME')  # Group cell detections by frame number.
@@ -50,7 +59,58 @@ def detect_mitosis(group, overlap_threshold=3):  # Detect mitosis events based o
             return True
     return False
 
-def classify_cells(data):
+class TrackLineage:
+    """Split points and spot links of a tracking run (lineage.csv / edges.csv).
+
+    Divisions are looked up per track instead of being reconstructed by scanning every frame,
+    so finding them costs O(events).
+    """
+
+    def __init__(self, lineage_df, edges_df, spots_df):
+        self.divisions = {}  # TRACK_ID -> [(mother spot ID, [daughter spot IDs])]
+        for (track_id, mother_id), daughters in lineage_df.groupby(['TRACK_ID', 'MOTHER_ID'])['DAUGHTER_ID']:
+            self.divisions.setdefault(int(track_id), []).append((int(mother_id), [int(d) for d in daughters]))
+        # Next spot of every spot that does not split
+        single_links = edges_df[~edges_df['SPOT_SOURCE_ID'].duplicated(keep=False)]
+        self.successor = dict(zip(single_links['SPOT_SOURCE_ID'].astype(int), single_links['SPOT_TARGET_ID'].astype(int)))
+        spot_ids = spots_df['ID'].astype(int)
+        self.position = dict(zip(spot_ids, zip(spots_df['POSITION_X'], spots_df['POSITION_Y'])))
+        self.area = dict(zip(spot_ids, spots_df['AREA']))
+
+    @classmethod
+    def load(cls, tracking_csv_dir, spots_df):
+        """Read lineage.csv and edges.csv from tracking_csv_dir; None if this run did not write them."""
+        lineage_path = os.path.join(tracking_csv_dir, "lineage.csv")
+        edges_path = os.path.join(tracking_csv_dir, "edges.csv")
+        if not (os.path.exists(lineage_path) and os.path.exists(edges_path)):
+            return None
+        return cls(pd.read_csv(lineage_path), pd.read_csv(edges_path), spots_df)
+
+    def detect_mitosis(self, track_id, overlap_threshold=3):
+        """Lineage counterpart of detect_mitosis: True if, after one of the track's splits, the two
+        daughters stay further apart than 1.3x their average diameter in at least overlap_threshold
+        of the next overlap_threshold + 1 frames."""
+        for mother_id, daughter_ids in self.divisions.get(int(track_id), []):
+            if len(daughter_ids) < 2:
+                continue
+            cell1, cell2 = daughter_ids[:2]
+            avg_diameter = 2 * np.sqrt((self.area[cell1] + self.area[cell2]) / (2 * np.pi))
+            distance_threshold = 1.3 * avg_diameter
+
+            frames_with_clear_separation = 0
+            for _ in range(overlap_threshold + 1):
+                if cell1 is None or cell2 is None:
+                    break
+                (x1, y1), (x2, y2) = self.position[cell1], self.position[cell2]
+                if np.hypot(x1 - x2, y1 - y2) > distance_threshold:
+                    frames_with_clear_separation += 1
+                cell1, cell2 = self.successor.get(cell1), self.successor.get(cell2)
+
+            if frames_with_clear_separation >= overlap_threshold:
+                return True
+        return False
+
+def classify_cells(data, lineage=None):
     results = []
     grouped = data.groupby('TRACK_ID')
     cell_count_threshold = 5
@@ -71,7 +131,7 @@ def classify_cells(data):
         if frames_exceeding_threshold >= frame_occurrence_threshold:
             classification = 'NaN'
         elif splits > 0:
-            mitosis_detected = detect_mitosis(group)
+            mitosis_detected = lineage.detect_mitosis(track_id) if lineage is not None else detect_mitosis(group)
             if mitosis_detected and sustained_rounding and significant_area_change:
                 classification = 'Y'
             elif splits > 0 and sustained_rounding and max_a > 2 * min_a:
@@ -103,19 +163,32 @@ def extract_last_number(filename):
     numbers = re.findall(r'\d+', filename)
     return int(numbers[-1]) if numbers else float('inf')
 
+def classify_tracks(spots_df, tracks_df, lineage=None):
+    """Merge spot and track tables and classify every track; returns (merged_df, classification_results).
+
+    With a TrackLineage, divisions come from the exported split points instead of detect_mitosis.
+    """
+    spots_df = spots_df.copy()
+    spots_df['ELLIPSE_ASPECTRATIO'] = pd.to_numeric(spots_df['ELLIPSE_ASPECTRATIO'], errors='coerce')
+    merged_df = pd.merge(spots_df, tracks_df, on='TRACK_ID', how='left')
+    return merged_df, classify_cells(merged_df, lineage)  # Run classification of each track into mitosis outcome types.
+
+def classification_percentages(classification_results):
+    # Percentage of tracks in each category (N, Y, T1F, T2F, etc).
+    classification_counts = classification_results['Classification'].value_counts()
+    total_tracks = classification_results.shape[0]
+    return {label: (count / total_tracks) * 100 for label, count in classification_counts.items()}
+
 def classify_cells_pipeline(tracking_csv_dir, original_frames_dir, output_overlay_dir, output_csv_path):
     tracks_df = pd.read_csv(os.path.join(tracking_csv_dir, "tracks.csv"))
     spots_df = pd.read_csv(os.path.join(tracking_csv_dir, "spots.csv"))
 
     os.makedirs(output_overlay_dir, exist_ok=True)
-    spots_df['ELLIPSE_ASPECTRATIO'] = pd.to_numeric(spots_df['ELLIPSE_ASPECTRATIO'], errors='coerce')
-    merged_df = pd.merge(spots_df, tracks_df, on='TRACK_ID', how='left')
-
-    classification_results = classify_cells(merged_df)  # Run classification of each track into mitosis outcome types.
+    lineage = TrackLineage.load(tracking_csv_dir, spots_df)  # None for tracking output without edges
+    merged_df, classification_results = classify_tracks(spots_df, tracks_df, lineage)
     # Compute classification rates
-    classification_counts = classification_results['Classification'].value_counts()  # Count how many tracks are classified into each category (N, Y, T1F, T2F, etc).
-    total_tracks = classification_results.shape[0]
-    classification_rates = {f"Rate {label}": f"{(count / total_tracks) * 100:.2f}%" for label, count in classification_counts.items()}
+    classification_rates = {f"Rate {label}": f"{rate:.2f}%"
+                            for label, rate in classification_percentages(classification_results).items()}
 
     # Save classification results
     classification_results.to_csv(output_csv_path, index=False)
@@ -166,22 +239,23 @@ def classify_cells_pipeline(tracking_csv_dir, original_frames_dir, output_overla
             dpi = 300
             original_array = np.array(original_frame)
 
-            plt.figure(figsize=(10, 10), dpi=dpi)
-            plt.imshow(original_array, cmap='gray', interpolation='nearest')
+            # A standalone Figure (not pyplot) so it can be rendered and saved on a writer thread
+            fig = Figure(figsize=(10, 10), dpi=dpi)
+            ax = fig.add_subplot()
+            ax.imshow(original_array, cmap='gray', interpolation='nearest')
 
             for _, row in frame_tracks.iterrows():
                 if not pd.isna(row['TRACK_ID']) and not pd.isna(row['POSITION_X']) and not pd.isna(row['POSITION_Y']):
                     x, y = row['POSITION_X'], row['POSITION_Y']
-                    plt.text(x, y, f"{int(row['TRACK_ID'])}: {row['Classification']}",  # Draw classification and track ID labels on the frame images.
+                    ax.text(x, y, f"{int(row['TRACK_ID'])}: {row['Classification']}",  # Draw classification and track ID labels on the frame images.
                             color=(1, 1, 1, 0.6), fontsize=4,
                             bbox=dict(facecolor='black', alpha=0.2, pad=0.2))
 
-            plt.title(f"Frame {frame} (Data Frame: {adjusted_frame})", fontsize=10)
-            plt.axis('off')
+            ax.set_title(f"Frame {frame} (Data Frame: {adjusted_frame})", fontsize=10)
+            ax.axis('off')
 
             overlay_path = os.path.join(output_overlay_dir, f"{os.path.splitext(file_name)[0]}_overlay.png")
-            plt.savefig(overlay_path, bbox_inches='tight', pad_inches=0, dpi=dpi)
-            plt.close()
+            submit_write(save_figure, fig, overlay_path, bbox_inches='tight', pad_inches=0, dpi=dpi)
             print(f"[✓] Overlay saved for {file_name}")
         else:
             print(f"[Overlay] Frame not found: {frame_path}")
@@ -0,0 +1,28 @@
+# process_pool_module.py
+
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+def spawn_pool(workers, initializer=None, initargs=()):
+    """Process pool whose workers are started with spawn.
+
+    Forking a parent that has already imported torch (or started threads) can deadlock the
+    workers, so every pool in the pipeline is created here.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=initializer, initargs=initargs)
+
+def bounded_map(executor, fn, items, workers):
+    """Yield fn(item) for every item, in input order, computed on executor.
+
+    Unlike executor.map, items are submitted as results are taken, with at most 2 * workers
+    in flight, so a long or lazily read input (frames, masks) is never held in memory at once.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
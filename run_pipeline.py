@@ -1,9 +1,14 @@
 # run_pipeline.py
 
 import os
-from segmentation_module import segment_frames
+import json
+import time
+from segmentation_module import MASK_STACK_NAME, segment_frames
 from tracking_module import run_trackmate_and_visualize
+from coarse_to_fine_module import segment_coarse_to_fine
+from autotune_module import AUTOTUNE_CONFIG_PATH, load_autotune_config
 from post_tracking_module import classify_cells_pipeline
+from writer_module import background_writes, flush_writes
 
 # --- User Configurable Paths ---
 INPUT_DIR = "input"  # Drop the original TIFF frames or movies here
@@ -12,6 +17,32 @@ TRACKING_CSV_DIR = "output/tracking_csv"
 OVERLAY_DIR_TRACKMATE = "output/trackmate_overlays"
 OVERLAY_DIR_MITOSIS = "output/mitosis_classification_overlays"
 CLASSIFIED_CSV_PATH = "output/classification_results.csv"
+COARSE_TO_FINE_DIR = "output/coarse_to_fine"
+RUN_METADATA_PATH = "output/run_metadata.json"
+
+# --- Segmentation Settings ---
+SEGMENTATION_BATCH_SIZE = 8  # Frames per model.eval call; saves per-call overhead only, Cellpose runs frames one by one
+NORMALIZATION = "frame"  # Stack inputs: "frame" (per-frame min/max), "global" or "rolling" percentiles
+SEGMENTATION_WORKERS = 1  # >1 segments batches in a process pool (one Cellpose model per worker)
+SEGMENTATION_TORCH_THREADS = None  # Torch threads per worker (None = cores / workers)
+USE_AUTOTUNE = True  # Take batch size / workers / threads from `python autotune_module.py` results if present
+SEGMENTATION_DOWNSAMPLE = 1.0  # >1 runs Cellpose on frames shrunk by this factor (masks are scaled back up)
+SEGMENTATION_TILE_SIZE = None  # Segment frames larger than this (pixels) as overlapping, stitched tiles (> 128, the overlap)
+SEGMENTATION_CACHE_DIR = "output/segmentation_cache"  # Reuse masks of unchanged frames across runs (None disables)
+MASK_STACK_OUTPUT = False  # True: write all masks into one compressed multi-page TIFF instead of one file per frame
+WRITE_INTERMEDIATES = True  # False: hand masks from segmentation to tracking in memory, skip frame/mask TIFFs
+COARSE_TO_FINE = False  # True: cheap first pass, full segmentation only around candidate divisions
+
+# --- Tracking Settings ---
+TRACKING_BACKEND = "trackmate"  # "trackmate" (Fiji/JVM) or "python" (built-in LAP tracker, no JVM needed)
+DETECTION_WORKERS = 1  # Python backend: processes measuring spots in the label masks
+REUSE_DETECTIONS = False  # Python backend: re-link the saved detections.csv instead of measuring the masks again
+TRACKING_WINDOW = None  # Track long movies in overlapping windows of this many frames (bounds memory); None = all at once
+TRACKING_WINDOW_OVERLAP = 20  # Frames shared by consecutive windows, used to join their tracks
+
+# --- Output Writing ---
+WRITER_THREADS = 2  # Background threads writing TIFF/PNG outputs while the next frame is computed
+MAX_PENDING_WRITES = 16  # Queued writes before producers wait (bounds memory held by unwritten images)
 
 # --- Ensure Output Directories Exist ---
 os.makedirs(SEGMENTED_DIR, exist_ok=True)
@@ -20,20 +51,64 @@ os.makedirs(OVERLAY_DIR_TRACKMATE, exist_ok=True)
 os.makedirs(OVERLAY_DIR_MITOSIS, exist_ok=True)
 
 # --- Pipeline Execution ---
+def write_run_metadata(metadata):
+    with open(RUN_METADATA_PATH, "w") as f:
+        json.dump(metadata, f, indent=2)
+
 def main():
+    # Outputs are written in the background; each stage is flushed before the next one reads it
+    with background_writes(WRITER_THREADS, MAX_PENDING_WRITES):
+        run_stages()
+
+    print("\n✅ Pipeline complete!")
+    print(f" - TrackMate overlays saved at: {OVERLAY_DIR_TRACKMATE}")
+    print(f" - Mitosis classification overlays saved at: {OVERLAY_DIR_MITOSIS}")
+    print(f" - Classification CSV saved at: {CLASSIFIED_CSV_PATH}")
+
+def run_stages():
     print("\n=== Stage 1: Segmenting Cells with Cellpose ===")
-    segment_frames(INPUT_DIR, SEGMENTED_DIR)
+    segment_options = dict(batch_size=SEGMENTATION_BATCH_SIZE,
+                           cache_dir=SEGMENTATION_CACHE_DIR,
+                           workers=SEGMENTATION_WORKERS,
+                           torch_threads=SEGMENTATION_TORCH_THREADS,
+                           tile_size=SEGMENTATION_TILE_SIZE,
+                           normalization=NORMALIZATION)
+    autotune_config = load_autotune_config() if USE_AUTOTUNE else None
+    if autotune_config:
+        segment_options.update(batch_size=autotune_config["batch_size"], workers=autotune_config["workers"],
+                               torch_threads=autotune_config["torch_threads"])
+        print(f"[Autotune] Using {AUTOTUNE_CONFIG_PATH}: batch_size={autotune_config['batch_size']} "
+              f"workers={autotune_config['workers']} torch_threads={autotune_config['torch_threads']}")
+    write_run_metadata({
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "segmentation": dict(segment_options, coarse_to_fine=COARSE_TO_FINE),
+        "segmentation_config_source": AUTOTUNE_CONFIG_PATH if autotune_config else "run_pipeline.py",
+        "autotune": autotune_config,
+    })
+
+    if COARSE_TO_FINE:
+        segment_coarse_to_fine(INPUT_DIR, SEGMENTED_DIR, COARSE_TO_FINE_DIR, backend=TRACKING_BACKEND, **segment_options)
+        mask_stack = mask_stack_path = None
+    else:
+        mask_stack = segment_frames(INPUT_DIR, SEGMENTED_DIR,
+                                    write_intermediates=WRITE_INTERMEDIATES,
+                                    return_masks=not WRITE_INTERMEDIATES,
+                                    stack_output=MASK_STACK_OUTPUT,
+                                    downsample=SEGMENTATION_DOWNSAMPLE,
+                                    **segment_options)
+        mask_stack_path = os.path.join(SEGMENTED_DIR, MASK_STACK_NAME) if MASK_STACK_OUTPUT else None
+    flush_writes()
 
     print("\n=== Stage 2: Tracking Cells with TrackMate ===")
-    run_trackmate_and_visualize(SEGMENTED_DIR, TRACKING_CSV_DIR, OVERLAY_DIR_TRACKMATE)
+    run_trackmate_and_visualize(SEGMENTED_DIR, TRACKING_CSV_DIR, OVERLAY_DIR_TRACKMATE,
+                                mask_stack=mask_stack, mask_stack_path=mask_stack_path,
+                                backend=TRACKING_BACKEND, detection_workers=DETECTION_WORKERS,
+                                reuse_detections=REUSE_DETECTIONS, time_window=TRACKING_WINDOW,
+                                window_overlap=TRACKING_WINDOW_OVERLAP)
+    flush_writes()
 
     print("\n=== Stage 3: Classifying Mitosis Outcomes ===")
     classify_cells_pipeline(TRACKING_CSV_DIR, INPUT_DIR, OVERLAY_DIR_MITOSIS, CLASSIFIED_CSV_PATH)
 
-    print("\n✅ Pipeline complete!")
-    print(f" - TrackMate overlays saved at: {OVERLAY_DIR_TRACKMATE}")
-    print(f" - Mitosis classification overlays saved at: {OVERLAY_DIR_MITOSIS}")
-    print(f" - Classification CSV saved at: {CLASSIFIED_CSV_PATH}")
-
 if __name__ == "__main__":
     main()
@@ -1,40 +1,261 @@
 import os
 import re
+import json
+import hashlib
+import itertools
+import threading
+import cv2
 import numpy as np
-from tifffile import imread, imwrite
-from cellpose import models
+from contextlib import nullcontext
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from tifffile import TiffFile, TiffWriter, imread, imwrite
 import random
-from typing import List
+from writer_module import submit_write
+from process_pool_module import bounded_map, spawn_pool
+from model_weights_module import DEFAULT_MODEL_TYPE, model_weights_path, recorded_checksum, verify_model_weights
+from typing import Iterable, Iterator, List, Optional, Tuple
 
-# Initialize Cellpose model globally (GPU optional)
-model = models.CellposeModel(model_type='livecell_cp3', gpu=True)
+# Cellpose models are built on first use and cached per (model_type, gpu, device)
+_models = {}
+
+def get_model(model_type: str = DEFAULT_MODEL_TYPE, gpu: bool = True, device: Optional[str] = None):
+    """Return a cached CellposeModel, constructing it (and importing torch) on first request.
+
+    Weights in the local store (MODEL_WEIGHTS_DIR) are checksum-verified and used directly;
+    otherwise Cellpose resolves model_type itself, which may need network access.
+    """
+    key = (model_type, gpu, device)
+    if key not in _models:
+        from cellpose import models  # Deferred: importing cellpose pulls in torch
+        weights_path = model_weights_path(model_type)
+        if os.path.isfile(weights_path):
+            verify_model_weights(weights_path)
+            model_kwargs = dict(pretrained_model=weights_path, gpu=gpu)
+        else:
+            model_kwargs = dict(model_type=model_type, gpu=gpu)
+        if device is not None:
+            import torch
+            model_kwargs.update(device=torch.device(device))
+        _models[key] = models.CellposeModel(**model_kwargs)
+        print(f"[Segmentation] Loaded Cellpose model: {model_type} (gpu={gpu}, device={device})")
+    return _models[key]
+
+def get_cellpose_version() -> str:
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        return version("cellpose")
+    except PackageNotFoundError:
+        return "unknown"
+
+def segmentation_params(model_type: str, eval_kwargs: Optional[dict] = None,
+                        tile_size: Optional[int] = None, tile_overlap: Optional[int] = None,
+                        downsample: float = 1.0) -> dict:
+    """Everything besides the pixels that determines a frame's mask, including the local weights' checksum."""
+    params = {"model_type": model_type, "cellpose_version": get_cellpose_version(), "eval": eval_kwargs or {}}
+    weights_checksum = recorded_checksum(model_weights_path(model_type))
+    if weights_checksum:
+        params.update(weights_sha256=weights_checksum)
+    if tile_size:
+        params.update(tile_size=tile_size, tile_overlap=tile_overlap)
+    if downsample != 1.0:
+        params.update(downsample=downsample)
+    return params
+
+def hash_frame(img: np.ndarray, params: Optional[dict] = None) -> str:
+    digest = hashlib.sha256()
+    digest.update(f"{img.dtype}{img.shape}".encode())
+    digest.update(np.ascontiguousarray(img).data)
+    if params is not None:
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+def hidden_tmp_path(path: str) -> str:
+    # Dot-prefixed so directory listings (list_frame_files, list_mask_files) skip it while it is being written
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+
+def imwrite_atomic(output_path: str, data: np.ndarray) -> None:
+    # Write next to the target and rename, so a crash never leaves a truncated TIFF behind
+    tmp_path = hidden_tmp_path(output_path)
+    imwrite(tmp_path, data)
+    os.replace(tmp_path, output_path)
+
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_TILE_OVERLAP = 128  # Pixels; must exceed the largest cell diameter for tiles to stitch cleanly
+
+class SegmentationCache:
+    """On-disk store of label masks keyed by frame pixels and model settings.
+
+    Entries are .npy files named by their key. A hit refreshes the file's mtime, and
+    once the cache grows past max_bytes the least recently used entries are deleted.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        ensure_directory_exists(cache_dir)
+
+    def key(self, img: np.ndarray, params: dict) -> str:
+        return hash_frame(img, params)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        try:
+            masks = np.load(path)
+            os.utime(path)
+        except (ValueError, OSError):  # Missing, evicted by another process, or unreadable
+            return None
+        return masks
+
+    def put(self, key: str, masks: np.ndarray) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, masks)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        # Other processes may share the cache directory, so entries can vanish at any point
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
 
 def ensure_directory_exists(directory: str) -> None:
     os.makedirs(directory, exist_ok=True)
 
+def rescale_to_16bit(image: np.ndarray, low: float, high: float) -> np.ndarray:
+    """Map [low, high] to [0, 65535] (clipping outside) using one float32 working copy."""
+    if high <= low:
+        return np.zeros(image.shape, dtype=np.uint16)
+    scaled = image.astype(np.float32)
+    scaled -= np.float32(low)
+    scaled *= np.float32(65535.0 / (high - low))
+    np.clip(scaled, 0, 65535, out=scaled)
+    return scaled.astype(np.uint16)
+
 def normalize_to_16bit(image: np.ndarray) -> np.ndarray:
-    min_val, max_val = np.min(image), np.max(image)
-    if max_val > min_val:
-        return ((image - min_val) / (max_val - min_val) * 65535).astype(np.uint16)
-    return np.zeros_like(image, dtype=np.uint16)
+    return rescale_to_16bit(image, np.min(image), np.max(image))
+
+DEFAULT_NORMALIZATION_PERCENTILES = (1.0, 99.0)
+DEFAULT_SAMPLES_PER_FRAME = 4096
+
+def compute_intensity_limits(raw_frames: Iterable[np.ndarray],
+                             percentiles: Tuple[float, float] = DEFAULT_NORMALIZATION_PERCENTILES,
+                             window: Optional[int] = None,
+                             samples_per_frame: int = DEFAULT_SAMPLES_PER_FRAME,
+                             positions: Optional[List[int]] = None) -> List[Tuple[float, float]]:
+    """One streaming pass over a stack, returning (low, high) intensity limits for every frame.
+
+    Each frame contributes a fixed-size random pixel sample. The limits are percentiles of the
+    samples of the whole stack (window=None) or of the window frames centred on each frame.
+    If raw_frames is a selection of a stack, positions gives their stack positions, so a
+    window only spans the selected frames within window // 2 positions of each frame.
+    """
+    rng = np.random.default_rng(0)
+    samples = []
+    for frame in raw_frames:
+        flat = frame.reshape(-1)
+        samples.append(flat[rng.integers(0, flat.size, size=min(samples_per_frame, flat.size))].astype(np.float32))
+    if not samples:
+        return []
+
+    if window is None:
+        low, high = np.percentile(np.concatenate(samples), percentiles)
+        return [(float(low), float(high))] * len(samples)
+
+    half = window // 2
+    positions = np.arange(len(samples)) if positions is None else np.asarray(positions)
+    limits = []
+    for position in positions:
+        first = np.searchsorted(positions, position - half)
+        last = np.searchsorted(positions, position + half, side="right")
+        low, high = np.percentile(np.concatenate(samples[first:last]), percentiles)
+        limits.append((float(low), float(high)))
+    return limits
 
 def natural_sort_key(s):
     """Sort strings by natural order (e.g., 1, 2, 10 instead of 1, 10, 2)"""
     return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
 
+class TiffStackFile:
+    """Random access by frame index to a TIFF stack: the first series, split along its first axis.
+
+    A stack with one page per frame is read page by page. Otherwise (ImageJ hyperstacks, in
+    particular stacks over 4 GB, which ImageJ writes as one contiguous block behind a single
+    page) the series is memory-mapped, so a frame still costs only its own bytes. A 2-D
+    series is a single frame.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tif = TiffFile(path)
+        self._series = self._tif.series[0]
+        self._n_frames = 1 if self._series.axes[0] in "YX" else self._series.shape[0]
+        self._stack = None
+
+    def __len__(self) -> int:
+        return self._n_frames
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        if len(self._series.pages) == self._n_frames:
+            return self._tif.asarray(key=index, series=0)
+        if self._stack is None:
+            # Maps the file itself if the series is stored contiguously, else decodes it into a temporary file
+            self._stack = self._series.asarray(out="memmap")
+        return np.array(self._stack[index])
+
+    def close(self) -> None:
+        self._stack = None
+        self._tif.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def iter_tiff_frames(tiff_path: str, positions: Optional[Iterable[int]] = None) -> Iterator[np.ndarray]:
+    """Yield the frames of a (multi-page) TIFF one at a time without loading the whole stack.
+
+    With positions (0-based) only those frames are read.
+    """
+    with TiffStackFile(tiff_path) as stack:
+        for idx in (range(len(stack)) if positions is None else positions):
+            yield stack[idx]
+
 def extract_frames(tiff_path: str, output_dir: str) -> List[str]:
     ensure_directory_exists(output_dir)
-    frames = imread(tiff_path)
-    frame_paths = []
-
-    for idx, frame in enumerate(frames):
-        frame_number = idx + 1
-        output_path = os.path.join(output_dir, f"frame_{frame_number}.tif")
-        imwrite(output_path, normalize_to_16bit(frame))
-        frame_paths.append(output_path)
-        print(f"[Segmentation] Saved frame: {output_path}")
+    return [os.path.join(output_dir, f"frame_{frame_number}.tif")
+            for frame_number, _ in iter_stack_frames(tiff_path, output_dir)]
 
-    return frame_paths
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 def apply_unique_colors(masks: np.ndarray) -> np.ndarray:
     color_mask = np.zeros((*masks.shape, 3), dtype=np.uint8)
@@ -46,33 +267,665 @@ def convert_rgb_to_16bit_grayscale(rgb_image: np.ndarray) -> np.ndarray:
     grayscale = np.dot(rgb_image[..., :3], [0.299, 0.587, 0.114])
     return normalize_to_16bit(grayscale)
 
-def segment_frame(frame_path: str, output_dir: str) -> None:
-    img = imread(frame_path)
-    masks, _, _ = model.eval(img)
+def encode_labels(masks: np.ndarray) -> np.ndarray:
+    """Relabel a Cellpose label image to consecutive ids 1..N with one lookup-table pass.
 
-    color_mask = apply_unique_colors(masks)
-    grayscale_mask = convert_rgb_to_16bit_grayscale(color_mask)
+    Unlike apply_unique_colors + convert_rgb_to_16bit_grayscale, every cell keeps its own
+    value, so TrackMate's LabelImageDetectorFactory cannot merge two cells. The result is
+    uint16 unless there are more than 65535 cells, in which case it is uint32.
+    """
+    labels = np.unique(masks)
+    labels = labels[labels > 0]
+    out_dtype = np.uint16 if len(labels) <= np.iinfo(np.uint16).max else np.uint32
+    if len(labels) == 0:
+        return np.zeros(masks.shape, dtype=out_dtype)
+    lut = np.zeros(int(labels[-1]) + 1, dtype=out_dtype)
+    lut[labels] = np.arange(1, len(labels) + 1, dtype=out_dtype)
+    return lut[masks]
 
+def frame_number_from_path(frame_path: str) -> str:
     # Extract frame number from filename
     match = re.search(r'frame_(\d+)', os.path.basename(frame_path))
-    frame_number = match.group(1) if match else 'unknown'
+    return match.group(1) if match else 'unknown'
 
-    output_path = os.path.join(output_dir, f"frame_{frame_number}_mask.tif")
-    imwrite(output_path, grayscale_mask)
-    print(f"[Segmentation] Saved grayscale mask: {output_path}")
+def frame_path(frame_number, output_dir: str) -> str:
+    return os.path.join(output_dir, f"frame_{frame_number}.tif")
 
-def segment_frames(input_path_or_dir: str, output_dir: str) -> None:
-    ensure_directory_exists(output_dir)
+def label_mask_path(frame_number, output_dir: str) -> str:
+    return os.path.join(output_dir, f"frame_{frame_number}_mask.tif")
 
-    if input_path_or_dir.lower().endswith((".tif", ".tiff")):
-        frame_paths = extract_frames(input_path_or_dir, output_dir)
+def list_mask_files(output_dir: str) -> List[str]:
+    """Return the frame_N_mask.tif files in output_dir in frame order, ignoring raw frame_N.tif files."""
+    return sorted(
+        [os.path.join(output_dir, f)
+         for f in os.listdir(output_dir)
+         if re.fullmatch(r"frame_\d+_mask\.tif", f)],
+        key=natural_sort_key
+    )
+
+def write_frame(img: np.ndarray, frame_number, output_dir: str) -> str:
+    # Normalized input frame, written like write_label_mask
+    output_path = frame_path(frame_number, output_dir)
+    submit_write(imwrite_atomic, output_path, img)
+    print(f"[Segmentation] Saved frame: {output_path}")
+    return output_path
+
+def write_label_mask(label_mask: np.ndarray, frame_number, output_dir: str) -> str:
+    # Goes through the background writer when one is active; the path is returned right away
+    output_path = label_mask_path(frame_number, output_dir)
+    submit_write(imwrite_atomic, output_path, label_mask)
+    print(f"[Segmentation] Saved label mask: {output_path}")
+    return output_path
+
+MASK_STACK_NAME = "masks.tif"
+
+class MaskStackWriter:
+    """Appends label masks as zlib-compressed pages of one multi-page TIFF.
+
+    Each frame is its own page, so frames can be read back individually (MaskStackFile) and
+    ImageJ opens the file directly as a stack. The file only appears under its final name
+    once closed. Pages are uint16, as ImageJ has no 32-bit integer images.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tmp_path = hidden_tmp_path(path)
+        self._writer = TiffWriter(self._tmp_path)
+
+    def write(self, label_mask: np.ndarray) -> None:
+        if label_mask.size and label_mask.max() > np.iinfo(np.uint16).max:
+            raise ValueError("Mask stacks hold at most 65535 labels per frame")
+        self._writer.write(label_mask.astype(np.uint16, copy=False), compression='zlib', metadata=None)
+
+    def close(self) -> None:
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+        print(f"[Segmentation] Saved mask stack: {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._writer.close()
+            os.remove(self._tmp_path)
+
+class MaskStackFile:
+    """Random access by frame index to a mask stack written by MaskStackWriter."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tif = TiffFile(path)
+
+    def __len__(self) -> int:
+        return len(self._tif.pages)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self._tif.asarray(key=index)
+
+    def close(self) -> None:
+        self._tif.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+MANIFEST_NAME = ".segmentation_manifest.json"  # Hidden so directory listings skip it
+
+class SegmentationManifest:
+    """Record of finished frames in an output directory, used to resume interrupted runs.
+
+    Each entry maps a frame number to the hash of its input pixels and the mask written for
+    it. The manifest is tied to the segmentation parameters; if they change it starts empty.
+    """
+
+    def __init__(self, output_dir: str, params: dict):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.params = json.loads(json.dumps(params, sort_keys=True, default=str))
+        self.frames = {}
+        self._lock = threading.Lock()  # record() may be called from background writer threads
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                manifest = json.load(f)
+            if manifest.get("params") == self.params:
+                self.frames = manifest.get("frames", {})
+
+    def is_done(self, frame_number, frame_hash: str) -> Optional[str]:
+        """Return the recorded mask path if this frame was already segmented from the same pixels."""
+        entry = self.frames.get(str(frame_number))
+        if entry and entry["input_hash"] == frame_hash and os.path.exists(entry["output_path"]):
+            return entry["output_path"]
+        return None
+
+    def record(self, frame_number, frame_hash: str, output_path: str) -> None:
+        with self._lock:
+            self.frames[str(frame_number)] = {"input_hash": frame_hash, "output_path": output_path}
+            tmp_path = hidden_tmp_path(self.path)
+            with open(tmp_path, "w") as f:
+                json.dump({"params": self.params, "frames": self.frames}, f)
+            os.replace(tmp_path, self.path)
+
+    def write_and_record(self, label_mask: np.ndarray, frame_number, frame_hash: str, output_path: str) -> None:
+        # Records the frame only once its mask is on disk, so a crash never leaves a dangling entry
+        imwrite_atomic(output_path, label_mask)
+        self.record(frame_number, frame_hash, output_path)
+
+def discard_manifest(output_dir: str) -> None:
+    """Forget the finished frames of output_dir, before its masks are replaced outside segment_frames."""
+    try:
+        os.remove(os.path.join(output_dir, MANIFEST_NAME))
+    except FileNotFoundError:
+        pass
+
+def eval_images(model, imgs: List[np.ndarray], eval_kwargs: Optional[dict] = None) -> List[np.ndarray]:
+    """Run model.eval once for the given images (a single image is evaluated on its own).
+
+    Cellpose 3 still runs the network one image at a time inside that call (its own batch_size
+    only batches the 224-pixel tiles of one image), so a list saves per-call overhead, not compute.
+    """
+    eval_kwargs = eval_kwargs or {}
+    if len(imgs) == 1:
+        masks, _, _ = model.eval(imgs[0], **eval_kwargs)
+        return [masks]
+    masks_list, _, _ = model.eval(list(imgs), **eval_kwargs)
+    return masks_list
+
+def iter_tiles(shape: Tuple[int, int], tile_size: int, overlap: int) -> Iterator[Tuple[slice, slice]]:
+    """Yield (row, column) slices of overlapping tiles covering a frame; the last tile is aligned to the edge."""
+    if overlap >= tile_size:
+        raise ValueError(f"tile overlap ({overlap}) must be smaller than tile_size ({tile_size})")
+    stride = tile_size - overlap
+
+    def starts(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+    for y in starts(shape[0]):
+        for x in starts(shape[1]):
+            yield slice(y, min(y + tile_size, shape[0])), slice(x, min(x + tile_size, shape[1]))
+
+def stitch_tile(out: np.ndarray, tile_masks: np.ndarray, region: Tuple[slice, slice],
+                next_label: int, match_threshold: float = 0.5) -> int:
+    """Merge one tile's labels into the frame-sized label image out, returning the next free label.
+
+    Cells cut by an interior tile edge are dropped (a neighbouring tile sees them whole as long
+    as the overlap exceeds the cell diameter). A remaining cell that covers at least
+    match_threshold of its area with an already stitched cell reuses that cell's label.
+    """
+    rows, cols = region
+    existing = out[rows, cols]  # View: writes go straight into out
+
+    edges = []
+    if rows.start > 0:
+        edges.append(tile_masks[0, :])
+    if rows.stop < out.shape[0]:
+        edges.append(tile_masks[-1, :])
+    if cols.start > 0:
+        edges.append(tile_masks[:, 0])
+    if cols.stop < out.shape[1]:
+        edges.append(tile_masks[:, -1])
+    n_labels = int(tile_masks.max())
+    if n_labels == 0:
+        return next_label
+    keep = np.ones(n_labels + 1, dtype=bool)
+    keep[0] = False
+    if edges:
+        keep[np.concatenate(edges)] = False
+    tile_masks = np.where(keep[tile_masks], tile_masks, 0)
+
+    areas = np.bincount(tile_masks.ravel(), minlength=n_labels + 1)
+    mapping = np.zeros(n_labels + 1, dtype=out.dtype)
+
+    both = (tile_masks > 0) & (existing > 0)
+    if both.any():
+        pair_codes = tile_masks[both].astype(np.uint64) * (int(existing.max()) + 1) + existing[both]
+        codes, counts = np.unique(pair_codes, return_counts=True)
+        tile_ids = (codes // (int(existing.max()) + 1)).astype(np.int64)
+        existing_ids = codes % (int(existing.max()) + 1)
+        # Best overlapping existing cell per tile cell
+        order = np.lexsort((-counts, tile_ids))
+        first = order[np.unique(tile_ids[order], return_index=True)[1]]
+        matched = counts[first] >= match_threshold * areas[tile_ids[first]]
+        mapping[tile_ids[first][matched]] = existing_ids[first][matched]
+
+    new_ids = np.flatnonzero((areas > 0) & (mapping == 0))
+    new_ids = new_ids[new_ids > 0]
+    mapping[new_ids] = np.arange(next_label, next_label + len(new_ids))
+
+    relabelled = mapping[tile_masks]
+    empty = (existing == 0) & (relabelled > 0)
+    existing[empty] = relabelled[empty]
+    return next_label + len(new_ids)
+
+def segment_tiled(img: np.ndarray, model, tile_size: int, overlap: int,
+                  eval_kwargs: Optional[dict] = None, tile_workers: int = 1) -> np.ndarray:
+    """Segment a large frame tile by tile and stitch the tiles into one label image.
+
+    Model memory scales with tile_size; tile_workers > 1 evaluates tiles on a thread pool.
+    """
+    regions = list(iter_tiles(img.shape[:2], tile_size, overlap))
+
+    def eval_tile(region):
+        return eval_images(model, [img[region]], eval_kwargs)[0]
+
+    out = np.zeros(img.shape[:2], dtype=np.uint32)
+    next_label = 1
+    if tile_workers > 1:
+        with ThreadPoolExecutor(max_workers=tile_workers) as executor:
+            for region, tile_masks in zip(regions, executor.map(eval_tile, regions)):
+                next_label = stitch_tile(out, tile_masks, region, next_label)
+    else:
+        for region in regions:
+            next_label = stitch_tile(out, eval_tile(region), region, next_label)
+    return out
+
+MODEL_CELL_DIAMETER = 30.0  # Cell diameter (pixels) the Cellpose models are trained at
+
+def downsample_for_diameter(cell_diameter: float, model_diameter: float = MODEL_CELL_DIAMETER) -> float:
+    """Downsampling factor that brings cells of cell_diameter pixels to the model's diameter (never upsamples)."""
+    return max(1.0, cell_diameter / model_diameter)
+
+def downscale_frame(img: np.ndarray, factor: float) -> np.ndarray:
+    if factor == 1.0:
+        return img
+    height, width = img.shape[:2]
+    size = (max(1, round(width / factor)), max(1, round(height / factor)))
+    if img.dtype not in (np.uint8, np.uint16, np.float32):
+        img = img.astype(np.float32)
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+def upscale_labels(masks: np.ndarray, shape: Tuple[int, int]) -> np.ndarray:
+    """Nearest-neighbour resize of a label image back to shape, keeping label ids intact."""
+    if masks.shape[:2] == tuple(shape[:2]):
+        return masks
+    rows = (np.arange(shape[0]) * masks.shape[0] // shape[0])
+    cols = (np.arange(shape[1]) * masks.shape[1] // shape[1])
+    return masks[rows[:, None], cols]
+
+def segment_images(imgs: List[np.ndarray], model=None, model_type: str = DEFAULT_MODEL_TYPE,
+                   gpu: bool = True, device: Optional[str] = None,
+                   cache: Optional[SegmentationCache] = None,
+                   eval_kwargs: Optional[dict] = None, tile_size: Optional[int] = None,
+                   tile_overlap: int = DEFAULT_TILE_OVERLAP, tile_workers: int = 1,
+                   downsample: float = 1.0) -> List[np.ndarray]:
+    """Return encoded label masks for imgs, running the model only on frames missing from the cache.
+
+    With downsample > 1 frames are shrunk by that factor before Cellpose and the masks are
+    scaled back up (nearest neighbour), so masks and spot positions stay in original pixels.
+    Frames (after downsampling) larger than tile_size are segmented with segment_tiled.
+    """
+    params = segmentation_params(model_type, eval_kwargs, tile_size, tile_overlap, downsample)
+
+    label_masks = [None] * len(imgs)
+    keys = [None] * len(imgs)
+    if cache is not None:
+        for idx, img in enumerate(imgs):
+            keys[idx] = cache.key(img, params)
+            label_masks[idx] = cache.get(keys[idx])
+
+    missing = [idx for idx, label_mask in enumerate(label_masks) if label_mask is None]
+    if missing:
+        if model is None:
+            model = get_model(model_type, gpu, device)
+        model_imgs = {idx: downscale_frame(imgs[idx], downsample) for idx in missing}
+        tiled = [idx for idx in missing if tile_size and max(model_imgs[idx].shape[:2]) > tile_size]
+        whole = [idx for idx in missing if idx not in tiled]
+        results = {idx: segment_tiled(model_imgs[idx], model, tile_size, tile_overlap, eval_kwargs, tile_workers)
+                   for idx in tiled}
+        if whole:
+            results.update(zip(whole, eval_images(model, [model_imgs[idx] for idx in whole], eval_kwargs)))
+        for idx in missing:
+            label_masks[idx] = encode_labels(upscale_labels(results[idx], imgs[idx].shape[:2]))
+            if cache is not None:
+                cache.put(keys[idx], label_masks[idx])
+    return label_masks
+
+# Per-process settings of a parallel segmentation worker, filled in by _init_segmentation_worker
+_worker_state = {}
+
+def _init_segmentation_worker(torch_threads: int, cache_dir: Optional[str], cache_max_bytes: int,
+                              segment_kwargs: dict) -> None:
+    import torch
+    torch.set_num_threads(torch_threads)  # Keep workers from oversubscribing the cores between them
+    get_model(segment_kwargs.get("model_type", DEFAULT_MODEL_TYPE),
+              segment_kwargs.get("gpu", True), segment_kwargs.get("device"))  # Load the model once per worker
+    _worker_state.update(segment_kwargs, cache=SegmentationCache(cache_dir, cache_max_bytes) if cache_dir else None)
+
+def _segment_batch_in_worker(batch: List) -> Tuple[tuple, List[np.ndarray]]:
+    frame_ids, imgs = zip(*batch)
+    return frame_ids, segment_images(list(imgs), **_worker_state)
+
+def _warm_up_worker(img: np.ndarray) -> int:
+    segment_images([img], **_worker_state)
+    return os.getpid()
+
+def segmentation_pool(workers: int, torch_threads: Optional[int] = None, cache_dir: Optional[str] = None,
+                      cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES, **segment_kwargs):
+    """Process pool of workers that each load the model once and run segment_images with segment_kwargs.
+
+    Each worker uses torch_threads threads (default: cores / workers). Workers start on demand;
+    warm_up_segmentation_pool starts them all.
+    """
+    if torch_threads is None:
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    return spawn_pool(workers, _init_segmentation_worker, (torch_threads, cache_dir, cache_max_bytes, segment_kwargs))
+
+def warm_up_segmentation_pool(executor, workers: int, img: np.ndarray) -> None:
+    """Start every worker of a segmentation_pool and segment img once in each (e.g. before timing the pool)."""
+    started = set()
+    while len(started) < workers:
+        started.update(executor.map(_warm_up_worker, [img] * workers))
+
+def iter_segmented_batches_parallel(batches: Iterable[List], workers: int, torch_threads: Optional[int] = None,
+                                    cache_dir: Optional[str] = None,
+                                    cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES, executor=None,
+                                    **segment_kwargs) -> Iterator[Tuple[tuple, List[np.ndarray]]]:
+    """Segment batches of (frame_id, image) pairs in a process pool.
+
+    segment_kwargs are passed on to segment_images in the workers. Results are yielded in
+    input order (see bounded_map). executor, a running segmentation_pool of workers processes,
+    is used instead of starting a new pool; the pool's own settings then apply.
+    """
+    if executor is not None:
+        yield from bounded_map(executor, _segment_batch_in_worker, batches, workers)
+        return
+    with segmentation_pool(workers, torch_threads, cache_dir, cache_max_bytes, **segment_kwargs) as executor:
+        yield from bounded_map(executor, _segment_batch_in_worker, batches, workers)
+
+def iter_segmented_batches(batches: Iterable[List], workers: int = 1, torch_threads: Optional[int] = None,
+                           cache_dir: Optional[str] = None, cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                           **segment_kwargs) -> Iterator[Tuple[tuple, List[np.ndarray]]]:
+    """Segment batches of (frame_id, image) pairs, yielding (frame_ids, label masks) in input order.
+
+    With workers > 1 this is iter_segmented_batches_parallel; otherwise batches are segmented
+    in this process, with torch_threads (if given) torch threads.
+    """
+    if workers > 1:
+        yield from iter_segmented_batches_parallel(batches, workers, torch_threads, cache_dir, cache_max_bytes,
+                                                   **segment_kwargs)
+        return
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    cache = SegmentationCache(cache_dir, cache_max_bytes) if cache_dir else None
+    for batch in batches:
+        frame_ids, imgs = zip(*batch)
+        yield frame_ids, segment_images(list(imgs), cache=cache, **segment_kwargs)
+
+def segment_frame(frame_path: str, output_dir: str, model=None,
+                  cache: Optional[SegmentationCache] = None,
+                  eval_kwargs: Optional[dict] = None) -> None:
+    img = imread(frame_path)
+    label_mask, = segment_images([img], model, cache=cache, eval_kwargs=eval_kwargs)
+    write_label_mask(label_mask, frame_number_from_path(frame_path), output_dir)
+
+def is_chunked_store(path: str) -> bool:
+    """True for a Zarr (incl. OME-Zarr) or N5 directory."""
+    if path.rstrip("/\\").lower().endswith((".zarr", ".n5")):
+        return True
+    return any(os.path.exists(os.path.join(path, name)) for name in (".zarray", ".zgroup", "zarr.json"))
+
+# Axis order assumed for chunked arrays without OME-NGFF axes metadata, by number of dimensions
+DEFAULT_CHUNKED_AXES = {2: "yx", 3: "tyx", 4: "tcyx", 5: "tczyx"}
+
+def open_chunked_array(store_path: str):
+    """Open a Zarr/N5 store lazily, returning (array, axes) for its full-resolution image.
+
+    For OME-Zarr groups the first multiscales dataset and its axes are used; plain arrays get
+    DEFAULT_CHUNKED_AXES. Indexing the returned array reads only the chunks it touches.
+    """
+    import zarr  # Optional dependency, only needed for chunked input
+    if store_path.rstrip("/\\").lower().endswith(".n5"):
+        try:
+            from zarr.n5 import N5Store  # Only available in zarr-python 2.x
+        except ImportError:
+            raise ImportError(f"Reading N5 stores needs zarr-python 2.x (pip install 'zarr<3'); "
+                              f"zarr {zarr.__version__} is installed") from None
+        node = zarr.open(N5Store(store_path), mode="r")
     else:
-        frame_paths = sorted(
-            [os.path.join(input_path_or_dir, f)
-             for f in os.listdir(input_path_or_dir)
-             if f.endswith((".tif", ".tiff"))],
-            key=natural_sort_key
-        )
-
-    for frame_path in frame_paths:
-        segment_frame(frame_path, output_dir)
\ No newline at end of file
+        node = zarr.open(store_path, mode="r")
+
+    axes = None
+    if isinstance(node, zarr.Group):
+        multiscales = node.attrs.get("multiscales") or node.attrs.get("ome", {}).get("multiscales")
+        if multiscales:
+            array = node[multiscales[0]["datasets"][0]["path"]]
+            ome_axes = multiscales[0].get("axes")
+            if ome_axes:
+                axes = "".join((axis["name"] if isinstance(axis, dict) else axis)[0].lower() for axis in ome_axes)
+        else:
+            array_keys = sorted(node.array_keys())
+            if not array_keys:
+                raise ValueError(f"No arrays found in chunked store: {store_path}")
+            array = node[array_keys[0]]
+    else:
+        array = node
+
+    if axes is None:
+        if array.ndim not in DEFAULT_CHUNKED_AXES:
+            raise ValueError(f"Unsupported {array.ndim}-D array in chunked store: {store_path}")
+        axes = DEFAULT_CHUNKED_AXES[array.ndim]
+    return array, axes
+
+def iter_chunked_frames(store_path: str, channel: Optional[int] = None, z_index: int = 0,
+                        positions: Optional[Iterable[int]] = None) -> Iterator[np.ndarray]:
+    """Yield 2-D frames from a Zarr/N5 store one time point at a time.
+
+    channel selects the c axis (default 0) and z_index the z plane when those axes exist.
+    With positions (0-based time points) only those frames are read.
+    """
+    array, axes = open_chunked_array(store_path)
+    selection = {"c": channel or 0, "z": z_index}
+    n_frames = array.shape[axes.index("t")] if "t" in axes else 1
+    for t in (range(n_frames) if positions is None else positions):
+        key = tuple(t if axis == "t" else selection.get(axis, slice(None)) for axis in axes)
+        yield np.asarray(array[key])
+
+def iter_stack_frames(tiff_path: str, output_dir: str, write_frames: bool = True) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yield (frame_number, normalized frame) pairs from a TIFF stack, optionally saving each frame."""
+    return iter_normalized_frames(iter_tiff_frames(tiff_path), output_dir, write_frames)
+
+def iter_normalized_frames(raw_frames: Iterable[np.ndarray], output_dir: str, write_frames: bool = True,
+                           limits: Optional[List[Tuple[float, float]]] = None,
+                           positions: Optional[Iterable[int]] = None) -> Iterator[Tuple[int, np.ndarray]]:
+    """Number and normalize raw frames, by precomputed per-frame limits or else each frame's min/max.
+
+    positions gives the 0-based stack positions of the raw frames when they are a selection.
+    """
+    for idx, (position, frame) in enumerate(zip(itertools.count() if positions is None else positions, raw_frames)):
+        frame_number = position + 1
+        normalized = rescale_to_16bit(frame, *limits[idx]) if limits is not None else normalize_to_16bit(frame)
+        if write_frames:
+            write_frame(normalized, frame_number, output_dir)
+        yield frame_number, normalized
+
+def list_frame_files(input_dir: str) -> List[str]:
+    return sorted(
+        [os.path.join(input_dir, f)
+         for f in os.listdir(input_dir)
+         if f.endswith((".tif", ".tiff"))],
+        key=natural_sort_key
+    )
+
+def iter_directory_frames(input_dir: str, positions: Optional[Iterable[int]] = None) -> Iterator[Tuple[str, np.ndarray]]:
+    """Yield (frame_number, image) pairs for the TIFF files of a directory in natural order.
+
+    With positions (0-based indices into that order) only those files are read.
+    """
+    frame_paths = list_frame_files(input_dir)
+    for idx in (range(len(frame_paths)) if positions is None else positions):
+        yield frame_number_from_path(frame_paths[idx]), imread(frame_paths[idx])
+
+def _raw_frame_reader(input_path_or_dir: str, channel: Optional[int] = None):
+    # reader(positions=...) yields the raw frames of a stack or store; None for a directory of TIFFs
+    if input_path_or_dir.lower().endswith((".tif", ".tiff")):
+        return partial(iter_tiff_frames, input_path_or_dir)
+    if is_chunked_store(input_path_or_dir):
+        return partial(iter_chunked_frames, input_path_or_dir, channel)
+    return None
+
+def input_intensity_limits(input_path_or_dir: str, channel: Optional[int] = None, normalization: str = "frame",
+                           percentiles: Tuple[float, float] = DEFAULT_NORMALIZATION_PERCENTILES,
+                           rolling_window: int = 15) -> Optional[List[Tuple[float, float]]]:
+    """The "global" or "rolling" limits of every frame of a stack or store, over all of its frames.
+
+    Passed as segment_frames(intensity_limits=...), they keep runs over different frame
+    selections on the scale of a full run. None for normalization="frame" or a directory input.
+    """
+    raw_frames = _raw_frame_reader(input_path_or_dir, channel)
+    if raw_frames is None or normalization == "frame":
+        return None
+    window = rolling_window if normalization == "rolling" else None
+    return compute_intensity_limits(raw_frames(), percentiles, window)
+
+def is_stack_input(input_path_or_dir: str) -> bool:
+    """True for a TIFF stack or chunked store, whose frames segment_frames normalizes (and can save)."""
+    return input_path_or_dir.lower().endswith((".tif", ".tiff")) or is_chunked_store(input_path_or_dir)
+
+def iter_input_frames(input_path_or_dir: str, output_dir: Optional[str] = None, write_frames: bool = False,
+                      channel: Optional[int] = None, normalization: str = "frame",
+                      percentiles: Tuple[float, float] = DEFAULT_NORMALIZATION_PERCENTILES,
+                      rolling_window: int = 15, positions: Optional[List[int]] = None,
+                      intensity_limits: Optional[List[Tuple[float, float]]] = None) -> Iterator[Tuple[str, np.ndarray]]:
+    """Yield (frame_number, image) for the frames segment_frames segments, prepared the same way.
+
+    Stack and store frames are normalized to 16 bit (see segment_frames) and, with write_frames,
+    saved as output_dir/frame_N.tif; directory frames are used as they are. positions (sorted,
+    0-based) reads only those frames.
+    """
+    if normalization not in ("frame", "global", "rolling"):
+        raise ValueError(f"Unknown normalization: {normalization}")
+    raw_frames = _raw_frame_reader(input_path_or_dir, channel)
+    if raw_frames is None:
+        return iter_directory_frames(input_path_or_dir, positions)
+
+    limits = None
+    if intensity_limits is not None:
+        limits = list(intensity_limits) if positions is None else [intensity_limits[p] for p in positions]
+    elif normalization != "frame":
+        window = rolling_window if normalization == "rolling" else None
+        limits = compute_intensity_limits(raw_frames(positions=positions), percentiles, window, positions=positions)
+    return iter_normalized_frames(raw_frames(positions=positions), output_dir, write_frames, limits, positions)
+
+def count_input_frames(input_path_or_dir: str) -> int:
+    """Number of frames segment_frames would process for this input, without reading pixels."""
+    if input_path_or_dir.lower().endswith((".tif", ".tiff")):
+        with TiffStackFile(input_path_or_dir) as stack:
+            return len(stack)
+    if is_chunked_store(input_path_or_dir):
+        array, axes = open_chunked_array(input_path_or_dir)
+        return array.shape[axes.index("t")] if "t" in axes else 1
+    return len(list_frame_files(input_path_or_dir))
+
+def segment_frames(input_path_or_dir: str, output_dir: str, batch_size: int = 1,
+                   model_type: str = DEFAULT_MODEL_TYPE, gpu: bool = True,
+                   device: Optional[str] = None, write_intermediates: bool = True,
+                   return_masks: bool = False, cache_dir: Optional[str] = None,
+                   cache_max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                   eval_kwargs: Optional[dict] = None, workers: int = 1,
+                   torch_threads: Optional[int] = None, tile_size: Optional[int] = None,
+                   tile_overlap: int = DEFAULT_TILE_OVERLAP, tile_workers: int = 1,
+                   resume: bool = True, stack_output: bool = False,
+                   channel: Optional[int] = None, normalization: str = "frame",
+                   percentiles: Tuple[float, float] = DEFAULT_NORMALIZATION_PERCENTILES,
+                   rolling_window: int = 15, downsample: float = 1.0,
+                   cell_diameter: Optional[float] = None,
+                   frame_indices: Optional[Iterable[int]] = None,
+                   intensity_limits: Optional[List[Tuple[float, float]]] = None) -> Optional[np.ndarray]:
+    """Segment every frame of a TIFF stack, a Zarr/OME-Zarr/N5 store or a directory of TIFFs.
+
+    batch_size frames go to one model.eval call (see eval_images: this trims per-call
+    overhead only, the masks are the same as with batch_size=1).
+    With write_intermediates=False no frame_N.tif / frame_N_mask.tif files are written.
+    With return_masks=True the label masks are returned as one (T, Y, X) stack so they
+    can be handed straight to tracking (note this keeps every mask in memory).
+    With cache_dir set, masks are looked up in a SegmentationCache before running Cellpose.
+    With workers > 1, batches are segmented in a process pool with one model per worker,
+    each limited to torch_threads threads (default: cores / workers); with one worker,
+    torch_threads (if given) sets this process's thread count.
+    With tile_size set, frames larger than tile_size are segmented as overlapping tiles
+    (tile_workers at a time) and stitched back together.
+    With resume=True (and write_intermediates), frames recorded in the output directory's
+    SegmentationManifest with unchanged pixels and parameters are not segmented again.
+    With stack_output=True all masks go into one compressed multi-page TIFF
+    (output_dir/masks.tif, see MaskStackWriter) instead of one file per frame; such runs
+    are not resumable.
+    For chunked stores, channel selects the channel to segment (default: the first).
+    Stack and store frames are scaled to 16 bit by their own min/max (normalization="frame"),
+    or by percentiles precomputed over the whole stack ("global") or over rolling_window
+    frames around each frame ("rolling"), which keeps intensities consistent between frames.
+    With downsample > 1 (or a cell_diameter above the model's, see downsample_for_diameter),
+    Cellpose runs on shrunken frames and masks are scaled back to full resolution.
+    frame_indices (0-based) restricts segmentation, outputs and returned masks to those frames;
+    only those frames are read, and "global"/"rolling" percentiles are computed over them alone.
+    intensity_limits, a (low, high) pair for every input frame (e.g. from compute_intensity_limits
+    over the whole stack), replaces that computation for stack and store inputs.
+    """
+    if cell_diameter is not None:
+        downsample = downsample_for_diameter(cell_diameter)
+    if tile_size and tile_overlap >= tile_size:
+        raise ValueError(f"tile_overlap ({tile_overlap}) must be smaller than tile_size ({tile_size})")
+    write_frame_masks = write_intermediates and not stack_output
+    if write_intermediates or stack_output:
+        ensure_directory_exists(output_dir)
+
+    positions = None  # Stack positions to read; None reads every frame
+    if frame_indices is not None:
+        n_frames = count_input_frames(input_path_or_dir)
+        positions = sorted(position for position in set(frame_indices) if 0 <= position < n_frames)
+    # Frames are extracted lazily, so only one batch of a stack is in memory at a time. They are
+    # saved below, once the manifest says they still need segmenting
+    frames = iter_input_frames(input_path_or_dir, None, False, channel, normalization,
+                               percentiles, rolling_window, positions, intensity_limits)
+    save_frames = write_intermediates and is_stack_input(input_path_or_dir)
+
+    manifest = None
+    if resume and write_frame_masks:
+        manifest = SegmentationManifest(output_dir, segmentation_params(model_type, eval_kwargs, tile_size, tile_overlap, downsample))
+    label_masks = {}
+
+    def pending_frames():
+        # Yields ((position, frame_number, frame_hash), image), skipping frames finished in an earlier run
+        for position, (frame_number, img) in zip(itertools.count() if positions is None else positions, frames):
+            frame_hash = hash_frame(img) if manifest is not None else None
+            done_path = manifest.is_done(frame_number, frame_hash) if manifest is not None else None
+            if done_path:
+                print(f"[Segmentation] Skipping finished frame: {frame_number}")
+                if save_frames and not os.path.exists(frame_path(frame_number, output_dir)):
+                    write_frame(img, frame_number, output_dir)
+                if return_masks:
+                    label_masks[position] = imread(done_path)
+                continue
+            if save_frames:
+                write_frame(img, frame_number, output_dir)
+            yield (position, frame_number, frame_hash), img
+
+    segment_kwargs = dict(model_type=model_type, gpu=gpu, device=device, eval_kwargs=eval_kwargs,
+                          tile_size=tile_size, tile_overlap=tile_overlap, tile_workers=tile_workers,
+                          downsample=downsample)
+    batches = iter_batches(pending_frames(), max(batch_size, 1))
+    segmented = iter_segmented_batches(batches, workers, torch_threads, cache_dir, cache_max_bytes, **segment_kwargs)
+
+    stack_context = MaskStackWriter(os.path.join(output_dir, MASK_STACK_NAME)) if stack_output else nullcontext()
+    with stack_context as stack_writer:
+        for frame_ids, batch_masks in segmented:
+            for (position, frame_number, frame_hash), label_mask in zip(frame_ids, batch_masks):
+                if stack_writer is not None:
+                    stack_writer.write(label_mask)
+                elif manifest is not None:
+                    output_path = label_mask_path(frame_number, output_dir)
+                    submit_write(manifest.write_and_record, label_mask, frame_number, frame_hash, output_path)
+                    print(f"[Segmentation] Saved label mask: {output_path}")
+                elif write_frame_masks:
+                    write_label_mask(label_mask, frame_number, output_dir)
+                if return_masks:
+                    label_masks[position] = label_mask
+
+    if return_masks:
+        return np.stack([label_masks[position] for position in sorted(label_masks)]) if label_masks else None
+    return None
@@ -0,0 +1,138 @@
+# spot_detection_module.py
+
+import os
+import cv2
+import numpy as np
+import pandas as pd
+from tifffile import imread
+from process_pool_module import bounded_map, spawn_pool
+
+detections_csv_name = "detections.csv"
+detection_columns = ["ID", "POSITION_X", "POSITION_Y", "POSITION_Z", "POSITION_T", "FRAME", "RADIUS",
+                     "AREA", "CIRCULARITY", "SOLIDITY", "ELLIPSE_ASPECTRATIO"]
+
+_edge_offsets = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+def measure_spots(label_mask, frame):
+    """Return a table with one row per label of a label mask and TrackMate's spot features.
+
+    Shape features describe each label's outer contour through its boundary pixel centres,
+    as cv2.findContours traces it. The contour polygon is made of the 2x2 windows of pixel
+    centres with 3 or 4 corners in the label (a triangle or a unit square), so its area and
+    length are bincount reductions over all labels at once, like the centroids and second
+    moments (for ELLIPSE_ASPECTRATIO). Only the convex hulls (for SOLIDITY) are computed
+    per label, from the label's boundary pixels alone. Labels are expected without holes
+    (Cellpose fills them); a hole would add its outline and lose its area.
+    """
+    label_mask = np.asarray(label_mask).astype(np.int64, copy=False)
+    height, width = label_mask.shape
+    n_labels = int(label_mask.max()) + 1
+    padded = np.pad(label_mask, 1)
+
+    foreground = label_mask > 0
+    labels = label_mask[foreground]
+    ys, xs = np.nonzero(foreground)
+    ys, xs = ys.astype(np.float64), xs.astype(np.float64)
+    pixel_count = np.bincount(labels, minlength=n_labels)
+    present = np.flatnonzero(pixel_count > 0)
+    present = present[present > 0]
+    if len(present) == 0:
+        return pd.DataFrame(columns=detection_columns[1:])
+
+    def label_sums(weights):
+        return np.bincount(labels, weights=weights, minlength=n_labels)[present]
+
+    def window_sums(corner, weights):
+        kept = (weights != 0) & (corner > 0)
+        return np.bincount(corner[kept], weights=weights[kept], minlength=n_labels)[present]
+
+    # Corners of every 2x2 window of pixel centres: a b over c d. A window with all four
+    # corners in one label is a unit square of its contour polygon; only the mixed windows
+    # can hold a triangle (3 corners) or a side of the polygon
+    a, b, c, d = padded[:-1, :-1], padded[:-1, 1:], padded[1:, :-1], padded[1:, 1:]
+    full = (a == b) & (a == c) & (a == d)
+    area = np.bincount(a[full], minlength=n_labels)[present].astype(np.float64)
+    mixed = ~full
+    a, b, c, d = a[mixed], b[mixed], c[mixed], d[mixed]
+    ab, ac, ad, bc, bd, cd = a == b, a == c, a == d, b == c, b == d, c == d
+    area += (window_sums(a, 0.5 * ((ab & ac) | (ab & ad) | (ac & ad)))
+             + window_sums(b, 0.5 * (bc & bd & ~ab)))
+    # A window side between two pixels of a label is on the contour unless the window covers it
+    # for that label; one-pixel-wide parts are walked there and back, so both sides count
+    top, bottom, left, right = ab & ~ac & ~ad, cd & ~ac & ~bc, ac & ~ab & ~ad, bd & ~ab & ~bc
+    diagonal = np.sqrt(2)
+    perimeter = (window_sums(a, top.astype(np.float64) + left + diagonal * (ad & ~ab) + diagonal * (ad & ~ac))
+                 + window_sums(b, right.astype(np.float64) + diagonal * (bc & ~ab) + diagonal * (bc & ~bd))
+                 + window_sums(c, bottom.astype(np.float64)))
+
+    n = pixel_count[present]
+    cx, cy = label_sums(xs) / n, label_sums(ys) / n
+    cov_xx = label_sums(xs * xs) / n - cx ** 2
+    cov_yy = label_sums(ys * ys) / n - cy ** 2
+    cov_xy = label_sums(xs * ys) / n - cx * cy
+    half_trace = (cov_xx + cov_yy) / 2
+    spread = np.sqrt(((cov_xx - cov_yy) / 2) ** 2 + cov_xy ** 2)
+    major, minor = half_trace + spread, np.maximum(half_trace - spread, 0)
+
+    # Convex hull of the boundary pixels (4-neighbourhood), which holds every contour point
+    interior = np.ones((height, width), bool)
+    for dy, dx in _edge_offsets:
+        interior &= padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width] == label_mask
+    by, bx = np.nonzero(foreground & ~interior)
+    boundary_labels = label_mask[by, bx]
+    order = np.argsort(boundary_labels, kind="stable")
+    splits = np.searchsorted(boundary_labels[order], present, side="right")[:-1]
+    hull_area = np.empty(len(present))
+    for idx, points in enumerate(np.split(np.stack([bx[order], by[order]], axis=1).astype(np.float32), splits)):
+        hull_area[idx] = cv2.contourArea(cv2.convexHull(points))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return pd.DataFrame({
+            "POSITION_X": cx,
+            "POSITION_Y": cy,
+            "POSITION_Z": 0.0,
+            "POSITION_T": float(frame),
+            "FRAME": frame,
+            "RADIUS": np.sqrt(area / np.pi),
+            "AREA": area,
+            "CIRCULARITY": np.where(perimeter > 0, 4 * np.pi * area / perimeter ** 2, np.nan),
+            "SOLIDITY": np.where(hull_area > 0, area / hull_area, np.nan),
+            "ELLIPSE_ASPECTRATIO": np.where(minor > 0, np.sqrt(major / minor), np.nan),
+        })
+
+def _measure_frame(frame_and_mask):
+    # label_mask may be a path, so workers read their own frames
+    frame, label_mask = frame_and_mask
+    if isinstance(label_mask, str):
+        label_mask = imread(label_mask)
+    return measure_spots(label_mask, frame)
+
+def detect_spots(masks, workers=1):
+    """Measure the spots of every frame in masks: a (T, Y, X) stack or any sequence of label masks or mask paths.
+
+    With workers > 1 frames are measured in a process pool (see bounded_map).
+    Returns the detections table (detection_columns), IDs numbered in frame order.
+    """
+    if workers > 1:
+        with spawn_pool(workers) as executor:
+            frame_tables = list(bounded_map(executor, _measure_frame, enumerate(masks), workers))
+    else:
+        frame_tables = [_measure_frame(frame_and_mask) for frame_and_mask in enumerate(masks)]
+
+    frame_tables = [table for table in frame_tables if len(table)]
+    spots = pd.concat(frame_tables, ignore_index=True) if frame_tables else pd.DataFrame(columns=detection_columns[1:])
+    spots.insert(0, "ID", np.arange(len(spots)))
+    return spots
+
+def write_detections(spots, output_dir):
+    """Save the detections table (detections.csv) next to the tracking results."""
+    path = os.path.join(output_dir, detections_csv_name)
+    spots.to_csv(path, columns=detection_columns, index=False)
+    return path
+
+def load_detections(csv_dir):
+    """Read detections.csv written by an earlier run, e.g. to re-link without measuring the masks again."""
+    path = os.path.join(csv_dir, detections_csv_name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No detections found at {path}; run the python tracking backend first")
+    return pd.read_csv(path)
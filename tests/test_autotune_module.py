@@ -0,0 +1,63 @@
+import json
+import sys
+import types
+
+import numpy as np
+from tifffile import imwrite
+
+import autotune_module
+import segmentation_module
+from test_segmentation_module import ThresholdModel, moving_disks_stack
+
+
+def test_autotune_reads_calibration_frames_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "movie.tif")
+    imwrite(path, moving_disks_stack(n_frames=30))
+    monkeypatch.setattr(segmentation_module, "get_model", lambda *args, **kwargs: ThresholdModel())
+    monkeypatch.setitem(sys.modules, "torch", types.SimpleNamespace(set_num_threads=lambda n: None))
+    read = []
+    read_frame = segmentation_module.TiffStackFile.__getitem__
+    monkeypatch.setattr(segmentation_module.TiffStackFile, "__getitem__",
+                        lambda stack_file, index: read.append(index) or read_frame(stack_file, index))
+
+    config_path = str(tmp_path / "autotune.json")
+    result = autotune_module.autotune_segmentation(path, config_path, n_frames=4, batch_sizes=(1, 2), workers=(1,))
+
+    assert sorted(read) == [0, 1, 2, 3]
+    assert len(result["measurements"]) == 2
+    assert result["calibration_frames"] == 4
+    with open(config_path) as f:
+        assert json.load(f)["batch_size"] in (1, 2)
+    assert np.isfinite(result["frames_per_second"])
+
+
+def test_candidate_configs_skip_idle_workers():
+    configs = autotune_module.candidate_configs(8, (1, 4, 8), (1, 2, 4), n_frames=8)
+    assert [(config["batch_size"], config["workers"]) for config in configs] == [
+        (1, 1), (1, 2), (1, 4), (4, 1), (4, 2), (8, 1)]
+
+
+def test_autotune_times_parallel_configs_after_the_workers_loaded_the_model(tmp_path, monkeypatch):
+    # Spawned workers import these stand-ins for torch and cellpose; loading the model takes 2 s
+    stubs = tmp_path / "stubs"
+    (stubs / "cellpose").mkdir(parents=True)
+    (stubs / "torch.py").write_text("def set_num_threads(n):\n    pass\n")
+    (stubs / "cellpose" / "__init__.py").write_text("")
+    (stubs / "cellpose" / "models.py").write_text(
+        "import time\n"
+        "from test_segmentation_module import ThresholdModel\n\n\n"
+        "class CellposeModel(ThresholdModel):\n"
+        "    def __init__(self, **kwargs):\n"
+        "        time.sleep(2)\n")
+    monkeypatch.syspath_prepend(str(stubs))
+    monkeypatch.setattr(segmentation_module, "get_model", lambda *args, **kwargs: ThresholdModel())
+    monkeypatch.setitem(sys.modules, "torch", types.SimpleNamespace(set_num_threads=lambda n: None))
+    monkeypatch.setattr(autotune_module.os, "cpu_count", lambda: 2)
+    path = str(tmp_path / "movie.tif")
+    imwrite(path, moving_disks_stack(n_frames=6))
+
+    result = autotune_module.autotune_segmentation(path, str(tmp_path / "autotune.json"), n_frames=4,
+                                                   batch_sizes=(1,), workers=(2,))
+
+    assert result["workers"] == 2
+    assert result["frames_per_second"] > 4  # Well under the 2 s model load
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import tracking_module
+from chunked_tracking_module import run_chunked_tracking, stitch_windows, time_windows
+from lap_tracker_module import track_spots
+
+linker = dict(linking_max_distance=10.0, gap_closing_max_distance=10.0, max_frame_gap=3, splitting_max_distance=10.0)
+
+
+def dividing_cells(n_frames, split_frame):
+    """A cell moving right alone, and a cell that divides into two daughters at split_frame."""
+    rows = []
+    for t in range(n_frames):
+        rows.append((t, 10 + t, 50))
+        if t < split_frame:
+            rows.append((t, 100 + t, 100))
+        else:
+            rows.extend([(t, 100 + t, 94), (t, 100 + t, 106)])
+    spots = pd.DataFrame(rows, columns=["FRAME", "POSITION_X", "POSITION_Y"])
+    spots["POSITION_T"] = spots["FRAME"].astype(float)
+    spots.insert(0, "ID", range(len(spots)))
+    return spots
+
+
+def track_in_windows(spots, windows):
+    results = []
+    for start, stop in windows:
+        window = spots[(spots["FRAME"] >= start) & (spots["FRAME"] < stop)].reset_index(drop=True)
+        window = window.assign(ID=range(len(window)), FRAME=window["FRAME"] - start,
+                               POSITION_T=window["POSITION_T"] - start)
+        results.append(track_spots(window, **linker))
+    return stitch_windows(results, windows)
+
+
+def edge_keys(spots, edges):
+    # Links by the (frame, x, y) of their spots, which do not depend on how spots are numbered
+    key = {spot_id: (frame, x, y) for spot_id, frame, x, y in
+           zip(spots["ID"], spots["FRAME"], spots["POSITION_X"], spots["POSITION_Y"])}
+    return sorted((key[source], key[target]) for source, target in zip(edges["SPOT_SOURCE_ID"], edges["SPOT_TARGET_ID"]))
+
+
+def test_time_windows_overlap_and_cover_the_movie():
+    assert time_windows(30, 20, 10) == [(0, 20), (10, 30)]
+    assert time_windows(45, 20, 5) == [(0, 20), (15, 35), (30, 45)]
+    assert time_windows(8, 20, 5) == [(0, 8)]
+    with pytest.raises(ValueError):
+        time_windows(30, 10, 10)
+
+
+@pytest.mark.parametrize("split_frame", [5, 12, 15, 18, 25])
+def test_stitch_windows_matches_unchunked_tracking(split_frame):
+    # Windows (0, 20) and (10, 30) are cut at frame 15; splits at 12 to 18 fall in their overlap
+    spots = dividing_cells(30, split_frame)
+    expected_spots, expected_tracks, expected_edges = track_spots(spots, **linker)
+    stitched_spots, stitched_tracks, stitched_edges = track_in_windows(spots, time_windows(30, 20, 10))
+
+    assert len(stitched_spots) == len(expected_spots)
+    assert stitched_spots["ID"].is_unique
+    assert edge_keys(stitched_spots, stitched_edges) == edge_keys(expected_spots, expected_edges)
+    columns = ["NUMBER_SPOTS", "NUMBER_SPLITS", "NUMBER_MERGES"]
+    assert stitched_tracks[columns].values.tolist() == expected_tracks[columns].values.tolist()
+    assert stitched_tracks["NUMBER_SPLITS"].tolist() == [0, 1]
+    np.testing.assert_allclose(stitched_tracks["TRACK_DISPLACEMENT"], expected_tracks["TRACK_DISPLACEMENT"])
+
+
+def test_stitch_windows_shifts_frames_and_times():
+    spots = dividing_cells(45, 40)
+    stitched_spots, _, _ = track_in_windows(spots, time_windows(45, 20, 5))
+
+    assert sorted(stitched_spots["FRAME"].unique()) == list(range(45))
+    np.testing.assert_allclose(stitched_spots["POSITION_T"], stitched_spots["FRAME"])
+    np.testing.assert_allclose(stitched_spots["POSITION_X"] - stitched_spots["FRAME"],
+                               np.where(stitched_spots["POSITION_Y"] == 50, 10, 100))
+
+
+def test_window_workers_use_the_linker_settings_of_the_caller(tmp_path, monkeypatch):
+    # A cell moving 5 px per frame and one moving 30 px: the default 50 px links both, 20 px only the first
+    masks = np.zeros((6, 80, 200), np.uint16)
+    for t in range(6):
+        masks[t, 10:20, 10 + 5 * t:20 + 5 * t] = 1
+        masks[t, 50:60, 10 + 30 * t:20 + 30 * t] = 2
+    monkeypatch.setattr(tracking_module, "linking_max_distance", 20.0)
+    monkeypatch.setattr(tracking_module, "gap_closing_max_distance", 20.0)
+
+    for workers in (1, 2):
+        output_dir = tmp_path / f"workers_{workers}"
+        output_dir.mkdir()
+        run_chunked_tracking(None, str(output_dir), window=4, overlap=2, backend="python", mask_stack=masks,
+                             workers=workers)
+        tracks = pd.read_csv(output_dir / "tracks.csv")
+        assert tracks["NUMBER_SPOTS"].tolist() == [6]
+
+    masks[:, 10:20] = 0  # No links at all
+    run_chunked_tracking(None, str(tmp_path), window=4, overlap=2, backend="python", mask_stack=masks, workers=1)
+    assert pd.read_csv(tmp_path / "edges.csv").empty
@@ -0,0 +1,55 @@
+import numpy as np
+from tifffile import imread, imwrite
+
+import coarse_to_fine_module
+import segmentation_module
+from coarse_to_fine_module import segment_coarse_to_fine
+from segmentation_module import input_intensity_limits, label_mask_path, segment_frames
+from test_segmentation_module import ThresholdModel, disk_image, moving_disks_stack
+
+
+def read_masks(output_dir, n_frames):
+    return np.stack([imread(label_mask_path(frame_number, output_dir)) for frame_number in range(1, n_frames + 1)])
+
+
+def test_segment_frames_after_coarse_to_fine_segments_every_frame_again(tmp_path, monkeypatch):
+    stack = moving_disks_stack(n_frames=20)
+    path = str(tmp_path / "movie.tif")
+    imwrite(path, stack)
+    output_dir = str(tmp_path / "segmented")
+    monkeypatch.setattr(segmentation_module, "get_model", lambda *args, **kwargs: ThresholdModel())
+
+    segment_frames(path, output_dir)
+    full = read_masks(output_dir, len(stack))
+    segment_coarse_to_fine(path, output_dir, str(tmp_path / "work"), frame_step=4, backend="python")
+    assert not all(read_masks(output_dir, len(stack)).any(axis=(1, 2)))  # Some frames were left empty
+
+    segment_frames(path, output_dir)
+    np.testing.assert_array_equal(read_masks(output_dir, len(stack)), full)
+
+
+def dividing_disk_stack(n_frames=20, split_frame=10, shape=(60, 80)):
+    # Intensity rises over the movie, so percentile limits differ between frame selections
+    return np.stack([disk_image(shape, [(30, 40)] if t < split_frame else [(30, 30), (30, 50)], radius=6) * (t + 1)
+                     for t in range(n_frames)])
+
+
+def test_both_passes_use_intensity_limits_of_the_whole_stack(tmp_path, monkeypatch):
+    stack = dividing_disk_stack()
+    path = str(tmp_path / "movie.tif")
+    imwrite(path, stack)
+    monkeypatch.setattr(segmentation_module, "get_model", lambda *args, **kwargs: ThresholdModel())
+    limits_used = []
+
+    def spy_segment_frames(*args, **kwargs):
+        limits_used.append(kwargs["intensity_limits"])
+        return segment_frames(*args, **kwargs)
+
+    monkeypatch.setattr(coarse_to_fine_module, "segment_frames", spy_segment_frames)
+    fine_positions = coarse_to_fine_module.segment_coarse_to_fine(
+        path, str(tmp_path / "segmented"), str(tmp_path / "work"), frame_step=4, backend="python",
+        normalization="rolling", rolling_window=5)
+
+    assert fine_positions  # The division was found, so both passes ran
+    assert limits_used == [input_intensity_limits(path, normalization="rolling", rolling_window=5)] * 2
+    assert len(limits_used[0]) == len(stack)
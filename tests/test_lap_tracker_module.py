@@ -0,0 +1,62 @@
+import pandas as pd
+
+from lap_tracker_module import track_spots
+
+linker = dict(linking_max_distance=5.0, gap_closing_max_distance=5.0, max_frame_gap=3, splitting_max_distance=5.0)
+
+
+def make_spots(rows):
+    """Detections table from (frame, x, y) rows, IDs in row order."""
+    spots = pd.DataFrame(rows, columns=["FRAME", "POSITION_X", "POSITION_Y"])
+    spots.insert(0, "ID", range(len(spots)))
+    return spots
+
+
+def track_of(spots, spot_id):
+    return int(spots.loc[spots["ID"] == spot_id, "TRACK_ID"].iloc[0])
+
+
+def test_links_frame_to_frame():
+    # Two cells moving right, close enough to be confused by a greedy nearest-neighbour linker
+    rows = [(t, x + 2 * t, y) for t in range(5) for x, y in [(10, 10), (10, 16)]]
+    spots, tracks, edges = track_spots(make_spots(rows), **linker)
+
+    assert len(tracks) == 2
+    assert tracks["NUMBER_SPOTS"].tolist() == [5, 5]
+    assert tracks["NUMBER_SPLITS"].tolist() == [0, 0]
+    assert len(edges) == 8
+    for source, target in zip(edges["SPOT_SOURCE_ID"], edges["SPOT_TARGET_ID"]):
+        assert target == source + 2
+
+
+def test_closes_gaps_up_to_max_frame_gap():
+    # The cell is missed in frames 2 and 3
+    rows = [(t, 10 + t, 10) for t in [0, 1, 4, 5]]
+    spots, tracks, edges = track_spots(make_spots(rows), **linker)
+
+    assert len(tracks) == 1
+    assert (1, 2) in set(zip(edges["SPOT_SOURCE_ID"], edges["SPOT_TARGET_ID"]))
+
+    spots, tracks, edges = track_spots(make_spots(rows), **dict(linker, max_frame_gap=2))
+    assert len(tracks) == 2
+    assert track_of(spots, 1) != track_of(spots, 2)
+
+
+def test_detects_split():
+    # Mother in frames 0-2, daughters on either side of it from frame 3
+    rows = [(t, 20, 20) for t in range(3)] + [(t, 20, y) for t in range(3, 6) for y in (18, 23)]
+    spots, tracks, edges = track_spots(make_spots(rows), **linker)
+
+    assert len(tracks) == 1
+    assert tracks["NUMBER_SPOTS"].iloc[0] == len(rows)
+    assert tracks["NUMBER_SPLITS"].iloc[0] == 1
+    assert sorted(edges.loc[edges["SPOT_SOURCE_ID"] == 2, "SPOT_TARGET_ID"]) == [3, 4]
+
+
+def test_drops_unlinked_spots():
+    rows = [(t, 10, 10) for t in range(3)] + [(1, 50, 50)]
+    spots, tracks, edges = track_spots(make_spots(rows), **linker)
+
+    assert len(tracks) == 1
+    assert 3 not in spots["ID"].tolist()
+    assert edges["TRACK_ID"].unique().tolist() == [0]
@@ -0,0 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from process_pool_module import bounded_map
+
+
+def test_bounded_map_keeps_order_and_reads_items_lazily():
+    taken = []
+
+    def items():
+        for item in range(20):
+            taken.append(item)
+            yield item
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = bounded_map(executor, lambda item: item * item, items(), workers=2)
+        first = next(results)
+        assert taken == [0, 1, 2, 3]  # Only 2 * workers items submitted before the first result
+        assert [first] + list(results) == [item * item for item in range(20)]
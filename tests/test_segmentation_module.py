@@ -0,0 +1,265 @@
+import os
+
+import numpy as np
+import pytest
+from scipy import ndimage
+from tifffile import imwrite
+
+import segmentation_module
+from segmentation_module import (SegmentationCache, compute_intensity_limits, count_input_frames, hash_frame,
+                                 iter_chunked_frames, iter_tiff_frames, iter_tiles, segment_frames, segment_images,
+                                 segment_tiled, stitch_tile)
+
+
+def make_stack(n_frames=5, height=6, width=7):
+    return np.arange(n_frames * height * width, dtype=np.uint16).reshape(n_frames, height, width)
+
+
+def test_iter_tiff_frames_multi_page(tmp_path):
+    stack = make_stack()
+    path = str(tmp_path / "movie.tif")
+    imwrite(path, stack, compression="zlib")
+
+    assert count_input_frames(path) == len(stack)
+    np.testing.assert_array_equal(np.stack(list(iter_tiff_frames(path))), stack)
+
+
+def test_iter_tiff_frames_truncated_imagej_stack(tmp_path):
+    # ImageJ saves stacks over 4 GB like this: all frames behind a single page
+    stack = make_stack()
+    path = str(tmp_path / "movie.tif")
+    imwrite(path, stack, imagej=True, truncate=True)
+
+    assert count_input_frames(path) == len(stack)
+    np.testing.assert_array_equal(np.stack(list(iter_tiff_frames(path))), stack)
+
+
+def test_iter_tiff_frames_single_image(tmp_path):
+    frame = make_stack(1)[0]
+    path = str(tmp_path / "frame.tif")
+    imwrite(path, frame)
+
+    assert count_input_frames(path) == 1
+    frames = list(iter_tiff_frames(path))
+    assert len(frames) == 1
+    np.testing.assert_array_equal(frames[0], frame)
+
+
+class ThresholdModel:
+    """Stand-in for a Cellpose model: labels the connected bright regions of an image."""
+
+    def eval(self, img, **kwargs):
+        if isinstance(img, list):
+            return [self.eval(one)[0] for one in img], None, None
+        labels, _ = ndimage.label(np.asarray(img) > 0)
+        return labels, None, None
+
+
+def disk_image(shape, centers, radius):
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    img = np.zeros(shape, dtype=np.uint16)
+    for cy, cx in centers:
+        img[(yy - cy) ** 2 + (xx - cx) ** 2 <= radius ** 2] = 1000
+    return img
+
+
+def assert_same_partition(a, b):
+    # Same cells, possibly under different label ids
+    pairs = np.unique(np.stack([a.ravel(), b.ravel()]), axis=1)
+    assert len(np.unique(pairs[0])) == pairs.shape[1]
+    assert len(np.unique(pairs[1])) == pairs.shape[1]
+
+
+def test_segment_tiled_matches_whole_frame():
+    rng = np.random.default_rng(1)
+    centers = [(y, x) for y in range(12, 200, 26) for x in range(12, 260, 26)]
+    centers = [(y + rng.integers(-3, 4), x + rng.integers(-3, 4)) for y, x in centers]
+    img = disk_image((200, 260), centers, radius=8)
+    model = ThresholdModel()
+
+    whole = model.eval(img)[0]
+    tiled = segment_tiled(img, model, tile_size=64, overlap=24)
+
+    assert_same_partition(whole, tiled)
+    assert len(np.unique(tiled)) - 1 == len(centers)
+
+
+def test_segment_tiled_parallel_tiles_match_serial():
+    img = disk_image((150, 150), [(20, 20), (60, 75), (75, 60), (130, 100)], radius=10)
+    model = ThresholdModel()
+
+    serial = segment_tiled(img, model, tile_size=50, overlap=30)
+    parallel = segment_tiled(img, model, tile_size=50, overlap=30, tile_workers=3)
+
+    np.testing.assert_array_equal(serial, parallel)
+
+
+def test_tile_overlap_must_be_smaller_than_tile_size(tmp_path):
+    assert len(list(iter_tiles((1000, 1000), 256, 128))) == 49
+    with pytest.raises(ValueError, match="tile overlap"):
+        list(iter_tiles((1000, 1000), 128, 128))
+
+    path = str(tmp_path / "movie.tif")
+    imwrite(path, make_stack())
+    with pytest.raises(ValueError, match="tile_overlap"):
+        segment_frames(path, str(tmp_path / "out"), tile_size=100)  # Default overlap is 128
+
+
+def test_stitch_tile_reuses_label_of_cell_seen_by_earlier_tile():
+    out = np.zeros((10, 20), dtype=np.uint32)
+    cell = np.zeros((10, 20), dtype=np.int32)
+    cell[3:7, 8:12] = 1  # Lies inside both tiles' overlap (columns 6..13)
+
+    next_label = stitch_tile(out, cell[:, :14], (slice(0, 10), slice(0, 14)), 1)
+    next_label = stitch_tile(out, cell[:, 6:], (slice(0, 10), slice(6, 20)), next_label)
+
+    assert next_label == 2
+    assert set(np.unique(out)) == {0, 1}
+    np.testing.assert_array_equal(out > 0, cell > 0)
+
+
+def test_stitch_tile_drops_cells_cut_by_interior_edge():
+    out = np.zeros((10, 20), dtype=np.uint32)
+    tile = np.zeros((10, 14), dtype=np.int32)
+    tile[3:7, 11:14] = 1  # Touches the tile's right edge, which is inside the frame
+
+    next_label = stitch_tile(out, tile, (slice(0, 10), slice(0, 14)), 1)
+
+    assert next_label == 1
+    assert not out.any()
+
+
+def test_iter_chunked_frames_n5(tmp_path):
+    zarr = pytest.importorskip("zarr")
+    stack = make_stack()
+    path = str(tmp_path / "movie.n5")
+    try:
+        from zarr.n5 import N5Store
+    except ImportError:
+        (tmp_path / "movie.n5").mkdir()
+        with pytest.raises(ImportError, match="zarr<3"):
+            list(iter_chunked_frames(path))
+        return
+    zarr.save_array(N5Store(path), stack)
+
+    assert count_input_frames(path) == len(stack)
+    np.testing.assert_array_equal(np.stack(list(iter_chunked_frames(path))), stack)
+
+
+def moving_disks_stack(n_frames=12, shape=(60, 80)):
+    return np.stack([disk_image(shape, [(20, 10 + 4 * t), (40, 60)], radius=6) * (t + 1) for t in range(n_frames)])
+
+
+def test_segment_frames_reads_only_selected_frames(tmp_path, monkeypatch):
+    stack = moving_disks_stack()
+    path = str(tmp_path / "movie.tif")
+    imwrite(path, stack)
+    monkeypatch.setattr(segmentation_module, "get_model", lambda *args, **kwargs: ThresholdModel())
+    full = segment_frames(path, None, write_intermediates=False, return_masks=True, normalization="global")
+
+    read = []
+    read_frame = segmentation_module.TiffStackFile.__getitem__
+    monkeypatch.setattr(segmentation_module.TiffStackFile, "__getitem__",
+                        lambda stack_file, index: read.append(index) or read_frame(stack_file, index))
+    selected = segment_frames(path, None, write_intermediates=False, return_masks=True, normalization="global",
+                              frame_indices=[7, 2, 99])
+
+    assert sorted(set(read)) == [2, 7]
+    assert selected.shape == (2, *stack.shape[1:])
+    np.testing.assert_array_equal(selected, full[[2, 7]])
+
+
+def test_compute_intensity_limits_rolling_window_over_selected_positions():
+    frames = [np.full((4, 4), value, dtype=np.float32) for value in range(10)]
+
+    every_frame = compute_intensity_limits(frames, (0, 100), window=3)
+    assert every_frame[0] == (0.0, 1.0)
+    assert every_frame[5] == (4.0, 6.0)
+
+    positions = [0, 1, 5, 6]
+    selected = compute_intensity_limits([frames[p] for p in positions], (0, 100), window=3, positions=positions)
+    assert selected == [(0.0, 1.0), (0.0, 1.0), (5.0, 6.0), (5.0, 6.0)]
+
+
+def test_segmentation_params_follow_local_weights_checksum(tmp_path, monkeypatch):
+    monkeypatch.setattr(segmentation_module, "model_weights_path", lambda model_type: str(tmp_path / model_type))
+    assert "weights_sha256" not in segmentation_module.segmentation_params("cyto3")
+
+    (tmp_path / "cyto3").write_bytes(b"old weights")
+    (tmp_path / "cyto3.sha256").write_text("aaaa  cyto3\n")
+    old_params = segmentation_module.segmentation_params("cyto3")
+    (tmp_path / "cyto3.sha256").write_text("bbbb  cyto3\n")
+    new_params = segmentation_module.segmentation_params("cyto3")
+
+    assert old_params["weights_sha256"] == "aaaa"
+    assert hash_frame(np.zeros(4), old_params) != hash_frame(np.zeros(4), new_params)
+
+
+class CountingModel(ThresholdModel):
+    def __init__(self):
+        self.images = 0
+
+    def eval(self, img, **kwargs):
+        if not isinstance(img, list):  # A list is evaluated one image at a time
+            self.images += 1
+        return super().eval(img, **kwargs)
+
+
+def test_resume_from_manifest(tmp_path, monkeypatch):
+    stack = moving_disks_stack(n_frames=6)
+    path, output_dir = str(tmp_path / "movie.tif"), str(tmp_path / "segmented")
+    imwrite(path, stack)
+    model = CountingModel()
+    monkeypatch.setattr(segmentation_module, "get_model", lambda *args, **kwargs: model)
+    segment_frames(path, output_dir)
+    assert model.images == 6
+
+    written = []
+    write = segmentation_module.imwrite_atomic
+    monkeypatch.setattr(segmentation_module, "imwrite_atomic",
+                        lambda output_path, data: written.append(os.path.basename(output_path)) or write(output_path, data))
+    segment_frames(path, output_dir)
+    assert model.images == 6
+    assert written == []  # Finished frames are neither segmented nor saved again
+
+    stack[2, 0, 0] = 1
+    imwrite(path, stack)
+    segment_frames(path, output_dir)
+    assert model.images == 7
+    assert sorted(written) == ["frame_3.tif", "frame_3_mask.tif"]
+
+    segment_frames(path, output_dir, eval_kwargs={"diameter": 20})
+    assert model.images == 13
+
+
+def test_segmentation_cache_hit_skips_the_model(tmp_path):
+    frames = list(moving_disks_stack(n_frames=3))
+    cache = SegmentationCache(str(tmp_path / "cache"))
+    model = CountingModel()
+    masks = segment_images(frames, model=model, cache=cache)
+    assert model.images == 3
+
+    cached_masks = segment_images(frames, model=model, cache=cache)
+    assert model.images == 3
+    for cached, mask in zip(cached_masks, masks):
+        np.testing.assert_array_equal(cached, mask)
+
+    segment_images(frames, model=model, cache=cache, eval_kwargs={"diameter": 20})
+    assert model.images == 6  # Other model settings are other keys
+
+
+def test_segmentation_cache_evicts_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    entry = np.zeros(100, np.uint8)
+    cache = SegmentationCache(cache_dir)
+    cache.put("a", entry)
+    entry_bytes = os.path.getsize(os.path.join(cache_dir, "a.npy"))
+    cache = SegmentationCache(cache_dir, max_bytes=2 * entry_bytes)
+    cache.put("b", entry)
+    os.utime(os.path.join(cache_dir, "a.npy"), (1000, 1000))
+    os.utime(os.path.join(cache_dir, "b.npy"), (2000, 2000))
+
+    assert cache.get("a") is not None  # Now more recently used than "b"
+    cache.put("c", entry)
+    assert sorted(os.listdir(cache_dir)) == ["a.npy", "c.npy"]
+    assert cache.get("b") is None
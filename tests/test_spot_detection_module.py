@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import ndimage
+
+from spot_detection_module import detect_spots, measure_spots
+
+shape_columns = ["AREA", "RADIUS", "CIRCULARITY", "SOLIDITY", "ELLIPSE_ASPECTRATIO"]
+
+
+def measure_spots_per_label(label_mask, frame):
+    """Reference: the features measured one label at a time on its cv2 contour."""
+    rows = []
+    for label, box in enumerate(ndimage.find_objects(label_mask), start=1):
+        if box is None:
+            continue
+        region = (label_mask[box] == label).astype(np.uint8)
+        ys, xs = np.nonzero(region)
+        contours, _ = cv2.findContours(region, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+        contour = max(contours, key=cv2.contourArea)
+        area = cv2.contourArea(contour)
+        perimeter = cv2.arcLength(contour, True)
+        hull_area = cv2.contourArea(cv2.convexHull(contour))
+        eigenvalues = np.linalg.eigvalsh(np.cov(np.stack([xs, ys]))) if len(xs) > 1 else np.zeros(2)
+        rows.append({
+            "POSITION_X": xs.mean() + box[1].start,
+            "POSITION_Y": ys.mean() + box[0].start,
+            "FRAME": frame,
+            "RADIUS": np.sqrt(area / np.pi),
+            "AREA": area,
+            "CIRCULARITY": 4 * np.pi * area / perimeter ** 2 if perimeter > 0 else np.nan,
+            "SOLIDITY": area / hull_area if hull_area > 0 else np.nan,
+            "ELLIPSE_ASPECTRATIO": np.sqrt(eigenvalues[1] / eigenvalues[0]) if eigenvalues[0] > 0 else np.nan,
+        })
+    return pd.DataFrame(rows)
+
+
+def shapes_mask():
+    yy, xx = np.mgrid[:120, :160]
+    mask = np.zeros((120, 160), np.int64)
+    mask[5:15, 5:15] = 1  # 10 x 10 square
+    mask[(yy - 30) ** 2 + (xx - 60) ** 2 <= 20 ** 2] = 2
+    mask[(yy - 90) ** 2 + (xx - 30) ** 2 <= 3 ** 2] = 3
+    mask[((yy - 90) / 12) ** 2 + ((xx - 100) / 5) ** 2 <= 1] = 4
+    mask[100, 130:140] = 5  # One pixel wide
+    mask[60, 140] = 6  # Single pixel
+    mask[119, 150:160] = 7  # Cut by the image edge
+    mask[118, 150:160] = 7
+    mask[(yy - 30) ** 2 + (xx - 85) ** 2 <= 6 ** 2] = 8  # Touches label 2
+    return mask
+
+
+def random_blobs_mask(seed):
+    rng = np.random.default_rng(seed)
+    blobs = ndimage.gaussian_filter(rng.random((150, 150)), 3 + seed % 4) > 0.51
+    labels, _ = ndimage.label(ndimage.binary_fill_holes(blobs))
+    return labels
+
+
+def assert_matches_per_label(label_mask):
+    expected = measure_spots_per_label(label_mask, 3)
+    spots = measure_spots(label_mask, 3)
+    assert len(spots) == len(expected)
+    for column in ["POSITION_X", "POSITION_Y", "FRAME"] + shape_columns:
+        np.testing.assert_allclose(spots[column], expected[column], rtol=1e-6, atol=1e-9, err_msg=column)
+
+
+def test_measure_spots_matches_per_label_contours():
+    assert_matches_per_label(shapes_mask())
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_measure_spots_matches_per_label_contours_on_random_blobs(seed):
+    assert_matches_per_label(random_blobs_mask(seed))
+
+
+def test_circularity_of_small_shapes():
+    spots = measure_spots(shapes_mask(), 0).set_index(np.arange(1, 9))
+    assert spots.loc[1, "CIRCULARITY"] == pytest.approx(np.pi / 4)
+    assert spots.loc[2, "CIRCULARITY"] < 0.9
+    assert spots.loc[5, "AREA"] == 0
+    assert np.isnan(spots.loc[6, "CIRCULARITY"])
+
+
+def test_detect_spots_parallel_matches_serial():
+    masks = np.stack([random_blobs_mask(seed) for seed in range(4)])
+    serial = detect_spots(masks)
+    parallel = detect_spots(list(masks), workers=2)
+
+    pd.testing.assert_frame_equal(parallel, serial)
+    assert serial["ID"].tolist() == list(range(len(serial)))
+    assert serial["FRAME"].unique().tolist() == [0, 1, 2, 3]
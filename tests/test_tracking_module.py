@@ -0,0 +1,48 @@
+import pandas as pd
+
+from lap_tracker_module import track_spots
+from post_tracking_module import TrackLineage
+from test_lap_tracker_module import linker, make_spots
+from tracking_module import export_tracking_results, lineage_columns, lineage_from_edges
+
+
+def mother_and_daughters():
+    # Mother in frames 0-2, daughters on either side of it from frame 3, and a cell that does not divide
+    rows = [(t, 20, 20) for t in range(3)] + [(t, 20, y) for t in range(3, 6) for y in (18, 23)]
+    return make_spots(rows + [(t, 60, 60) for t in range(6)])
+
+
+def test_lineage_from_edges_lists_each_daughter_link():
+    spots = pd.DataFrame({"ID": range(8), "FRAME": [0, 1, 2, 3, 3, 4, 0, 1]})
+    edges = pd.DataFrame({"SPOT_SOURCE_ID": [0, 1, 2, 2, 3, 6], "SPOT_TARGET_ID": [1, 2, 4, 3, 5, 7],
+                          "LINK_COST": 1.0, "TRACK_ID": [0, 0, 0, 0, 0, 1]})
+    lineage = lineage_from_edges(edges, spots)
+
+    assert list(lineage.columns) == lineage_columns
+    assert lineage.values.tolist() == [[0, 2, 2, 3], [0, 2, 2, 4]]
+
+
+def test_lineage_from_edges_without_splits():
+    edges = pd.DataFrame({"SPOT_SOURCE_ID": [0], "SPOT_TARGET_ID": [1], "LINK_COST": [1.0], "TRACK_ID": [0]})
+    assert lineage_from_edges(edges, pd.DataFrame({"ID": [0, 1], "FRAME": [0, 1]})).empty
+
+
+def test_lineage_of_tracked_division():
+    spots, tracks, edges = track_spots(mother_and_daughters(), **linker)
+    lineage = lineage_from_edges(edges, spots)
+
+    assert lineage[["SPLIT_FRAME", "MOTHER_ID", "DAUGHTER_ID"]].values.tolist() == [[2, 2, 3], [2, 2, 4]]
+    assert lineage["TRACK_ID"].nunique() == 1
+    assert tracks.set_index("TRACK_ID").loc[lineage["TRACK_ID"].iloc[0], "NUMBER_SPLITS"] == 1
+
+
+def test_exported_lineage_loads_as_track_lineage(tmp_path):
+    spots, tracks, edges = track_spots(mother_and_daughters(), **linker)
+    spots = spots.assign(POSITION_Z=0.0, POSITION_T=spots["FRAME"].astype(float), RADIUS=2.0, AREA=12.0,
+                         CIRCULARITY=0.9, SOLIDITY=1.0, ELLIPSE_ASPECTRATIO=1.0)
+    export_tracking_results(spots, tracks, edges, str(tmp_path))
+
+    lineage = TrackLineage.load(str(tmp_path), spots)
+    track_id = int(spots.loc[spots["ID"] == 2, "TRACK_ID"].iloc[0])
+    assert lineage.divisions == {track_id: [(2, [3, 4])]}
+    assert lineage.successor[0] == 1 and 2 not in lineage.successor
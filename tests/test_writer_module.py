@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+from writer_module import BackgroundWriter
+
+
+def fail_write():
+    raise OSError("disk full")
+
+
+def test_flush_reraises_a_failed_write():
+    written = []
+    writer = BackgroundWriter(threads=2)
+    writer.submit(written.append, 1)
+    writer.submit(fail_write)
+    writer.submit(written.append, 2)
+    with pytest.raises(OSError, match="disk full"):
+        writer.flush()
+    assert sorted(written) == [1, 2]  # The other writes still ran
+
+    writer.flush()  # An error is raised once
+    writer.close()
+
+
+def test_submit_blocks_at_max_pending():
+    release = threading.Event()
+    writer = BackgroundWriter(threads=1, max_pending=2)
+    writer.submit(release.wait)
+    writer.submit(release.wait)
+
+    submitted = threading.Event()
+    submitter = threading.Thread(target=lambda: (writer.submit(lambda: None), submitted.set()))
+    submitter.start()
+    assert not submitted.wait(0.2)  # Both slots are taken
+
+    release.set()
+    assert submitted.wait(5)
+    submitter.join()
+    writer.close()
@@ -1,142 +1,352 @@
 # tracking_module.py
 
 import os
-import imagej
 import pandas as pd
 import numpy as np
 import cv2
 from PIL import Image
+from segmentation_module import MaskStackFile, list_mask_files
+from lap_tracker_module import track_spots
+from spot_detection_module import detect_spots, write_detections, load_detections, detections_csv_name
+from writer_module import submit_write
 
 # Constants (can be customized or passed to the function)
 linking_max_distance = 50.0
 gap_closing_max_distance = 50.0
 max_frame_gap = 5
+splitting_max_distance = 20.0
 tracks_csv_name = "tracks.csv"
 spots_csv_name = "spots.csv"
+spot_columns = ["ID", "TRACK_ID", "POSITION_X", "POSITION_Y", "POSITION_Z", "POSITION_T",
+                "FRAME", "RADIUS", "CIRCULARITY", "SOLIDITY", "AREA", "ELLIPSE_ASPECTRATIO"]
+track_columns = ["TRACK_ID", "NUMBER_SPOTS", "NUMBER_SPLITS", "NUMBER_MERGES", "TRACK_DISPLACEMENT"]
+edges_csv_name = "edges.csv"
+edge_columns = ["SPOT_SOURCE_ID", "SPOT_TARGET_ID", "LINK_COST", "TRACK_ID"]
+lineage_csv_name = "lineage.csv"
+lineage_columns = ["TRACK_ID", "SPLIT_FRAME", "MOTHER_ID", "DAUGHTER_ID"]
+tracking_backends = ("trackmate", "python")
 
-# Initialize Fiji / ImageJ once globally
-ij = imagej.init('Fiji.app', headless=True)  # Start ImageJ instance (specifically, Fiji) for TrackMate plugin access.
+# TrackMate Groovy script. Inputs are passed through script bindings (inputImp, stackPath or maskPaths,
+# linkingMaxDistance, gapClosingMaxDistance, maxFrameGap, splittingMaxDistance) so it is compiled only once per session.
+TRACKMATE_SCRIPT = """
+import ij.IJ;
+import ij.ImageStack;
+import fiji.plugin.trackmate.Model;
+import fiji.plugin.trackmate.Settings;
+import fiji.plugin.trackmate.TrackMate;
+import fiji.plugin.trackmate.detection.LabelImageDetectorFactory;
+import fiji.plugin.trackmate.Logger;
+import fiji.plugin.trackmate.providers.TrackerProvider;
+import fiji.plugin.trackmate.features.spot.SpotShapeAnalyzerFactory;
+import fiji.plugin.trackmate.features.spot.SpotFitEllipseAnalyzerFactory;
+import ij.ImagePlus;
+
+ImagePlus imp;
+if (inputImp != null) {
+    imp = inputImp;
+} else if (stackPath != null) {
+    imp = IJ.openImage(stackPath);
+} else {
+    // Explicit mask files, one per frame, so nothing else in their folder can end up in the stack
+    ImageStack stack = null;
+    for (path in maskPaths) {
+        ImagePlus mask = IJ.openImage(path);
+        if (mask == null) {
+            throw new IllegalArgumentException("Failed to open mask: " + path);
+        }
+        if (stack == null) {
+            stack = new ImageStack(mask.getWidth(), mask.getHeight());
+        }
+        stack.addSlice(mask.getProcessor());
+    }
+    imp = stack != null ? new ImagePlus("masks", stack) : null;
+}
+if (imp == null) {
+    throw new IllegalArgumentException("Failed to load the image sequence.");
+}
+
+if (imp.getNFrames() == 1 && imp.getNSlices() > 1) {
+    imp.setDimensions(1, 1, imp.getStackSize());
+}
+
+Model model = new Model();
+model.setLogger(Logger.DEFAULT_LOGGER);
+Settings settings = new Settings().copyOn(imp);
+
+settings.detectorFactory = new LabelImageDetectorFactory();
+settings.detectorSettings.put("TARGET_CHANNEL", 1 as java.lang.Integer);
+settings.detectorSettings.put("SIMPLIFY_CONTOURS", true);
+
+settings.addSpotAnalyzerFactory(new SpotShapeAnalyzerFactory());
+settings.addSpotAnalyzerFactory(new SpotFitEllipseAnalyzerFactory());
+
+TrackerProvider trackerProvider = new TrackerProvider();
+settings.trackerFactory = trackerProvider.getFactory("SPARSE_LAP_TRACKER");
+settings.trackerSettings.put("LINKING_MAX_DISTANCE", linkingMaxDistance as java.lang.Double);
+settings.trackerSettings.put("GAP_CLOSING_MAX_DISTANCE", gapClosingMaxDistance as java.lang.Double);
+settings.trackerSettings.put("ALLOW_GAP_CLOSING", true);
+settings.trackerSettings.put("MAX_FRAME_GAP", maxFrameGap as java.lang.Integer);
+settings.trackerSettings.put("ALLOW_TRACK_SPLITTING", true);
+settings.trackerSettings.put("SPLITTING_MAX_DISTANCE", splittingMaxDistance as java.lang.Double);
+settings.trackerSettings.put("ALLOW_TRACK_MERGING", false);
+settings.trackerSettings.put("MERGING_MAX_DISTANCE", 20.0 as java.lang.Double);
+settings.trackerSettings.put("ALTERNATIVE_LINKING_COST_FACTOR", 1.05 as java.lang.Double);
+settings.trackerSettings.put("CUTOFF_PERCENTILE", 0.9 as java.lang.Double);
+settings.trackerSettings.put("BLOCKING_VALUE", 10000.0 as java.lang.Double);
+
+TrackMate trackmate = new TrackMate(model, settings);
+if (!trackmate.checkInput()) {
+    throw new IllegalArgumentException("TrackMate input check failed: " + trackmate.getErrorMessage());
+}
+if (!trackmate.process()) {
+    throw new IllegalArgumentException("TrackMate process failed: " + trackmate.getErrorMessage());
+}
+
+// Results are returned column by column as primitive arrays, so Python copies each column in one
+// bulk transfer instead of reading every field of every spot through the JVM bridge.
+def trackModel = model.getTrackModel();
+def featureModel = model.getFeatureModel();
+def trackIDs = new ArrayList(trackModel.trackIDs(true));
+
+def spotFeatures = ['POSITION_X', 'POSITION_Y', 'POSITION_Z', 'POSITION_T', 'FRAME', 'RADIUS',
+                    'AREA', 'CIRCULARITY', 'SOLIDITY', 'ELLIPSE_ASPECTRATIO'];
+def trackedSpots = [];
+def spotTrackIDs = [];
+for (trackID in trackIDs) {
+    for (spot in trackModel.trackSpots(trackID)) {
+        trackedSpots.add(spot);
+        spotTrackIDs.add(trackID);
+    }
+}
+int nSpots = trackedSpots.size();
+int[] spotIDs = new int[nSpots];
+int[] spotTrackIDArray = new int[nSpots];
+double[][] spotValues = new double[spotFeatures.size()][nSpots];
+for (int i = 0; i < nSpots; i++) {
+    def spot = trackedSpots.get(i);
+    spotIDs[i] = spot.ID();
+    spotTrackIDArray[i] = spotTrackIDs.get(i);
+    for (int f = 0; f < spotFeatures.size(); f++) {
+        Double value = spot.getFeature(spotFeatures.get(f));
+        spotValues[f][i] = value != null ? value : Double.NaN;
+    }
+}
+def spotsData = ['ID': spotIDs, 'TRACK_ID': spotTrackIDArray];
+for (int f = 0; f < spotFeatures.size(); f++) {
+    spotsData[spotFeatures.get(f)] = spotValues[f];
+}
+
+def trackFeatures = ['NUMBER_SPLITS', 'NUMBER_MERGES', 'TRACK_DISPLACEMENT'];
+int nTracks = trackIDs.size();
+int[] trackIDArray = new int[nTracks];
+int[] trackSpotCounts = new int[nTracks];
+double[][] trackValues = new double[trackFeatures.size()][nTracks];
+for (int i = 0; i < nTracks; i++) {
+    def trackID = trackIDs.get(i);
+    trackIDArray[i] = trackID;
+    trackSpotCounts[i] = trackModel.trackSpots(trackID).size();
+    for (int f = 0; f < trackFeatures.size(); f++) {
+        Double value = featureModel.getTrackFeature(trackID, trackFeatures.get(f));
+        trackValues[f][i] = value != null ? value : Double.NaN;
+    }
+}
+def tracksData = ['TRACK_ID': trackIDArray, 'NUMBER_SPOTS': trackSpotCounts];
+for (int f = 0; f < trackFeatures.size(); f++) {
+    tracksData[trackFeatures.get(f)] = trackValues[f];
+}
+
+// Links between spots, oriented forward in time; a spot with two outgoing links is a split
+def trackedEdges = [];
+def edgeTrackIDs = [];
+for (trackID in trackIDs) {
+    for (edge in trackModel.trackEdges(trackID)) {
+        trackedEdges.add(edge);
+        edgeTrackIDs.add(trackID);
+    }
+}
+int nEdges = trackedEdges.size();
+int[] edgeSourceIDs = new int[nEdges];
+int[] edgeTargetIDs = new int[nEdges];
+int[] edgeTrackIDArray = new int[nEdges];
+double[] edgeCosts = new double[nEdges];
+for (int i = 0; i < nEdges; i++) {
+    def edge = trackedEdges.get(i);
+    def source = trackModel.getEdgeSource(edge);
+    def target = trackModel.getEdgeTarget(edge);
+    if (source.getFeature('FRAME') > target.getFeature('FRAME')) {
+        def earlier = target;
+        target = source;
+        source = earlier;
+    }
+    edgeSourceIDs[i] = source.ID();
+    edgeTargetIDs[i] = target.ID();
+    edgeTrackIDArray[i] = edgeTrackIDs.get(i);
+    edgeCosts[i] = trackModel.getEdgeWeight(edge);
+}
+def edgesData = ['SPOT_SOURCE_ID': edgeSourceIDs, 'SPOT_TARGET_ID': edgeTargetIDs,
+                 'LINK_COST': edgeCosts, 'TRACK_ID': edgeTrackIDArray];
+
+return ['spots': spotsData, 'tracks': tracksData, 'edges': edgesData];
+"""
+
+class TrackMateSession:
+    """Fiji instance and compiled TrackMate script, started on first use and reusable across runs."""
+
+    def __init__(self, fiji_path='Fiji.app', headless=True):
+        self.fiji_path = fiji_path
+        self.headless = headless
+        self._ij = None
+        self._script_engine = None
+        self._compiled_script = None
+
+    @property
+    def ij(self):
+        if self._ij is None:
+            import imagej  # Deferred: importing/initializing pyimagej boots the JVM
+            print(f"[Tracking] Starting Fiji from {self.fiji_path}")
+            self._ij = imagej.init(self.fiji_path, headless=self.headless)  # Start ImageJ instance (specifically, Fiji) for TrackMate plugin access.
+        return self._ij
+
+    @property
+    def script_engine(self):
+        if self._script_engine is None:
+            self._script_engine = self.ij.script().getLanguageByName("Groovy").getScriptEngine()
+        return self._script_engine
+
+    def eval_trackmate(self, bindings):
+        if self._compiled_script is None:
+            self._compiled_script = self.script_engine.compile(TRACKMATE_SCRIPT)
+        script_bindings = self.script_engine.createBindings()
+        for name, value in bindings.items():
+            script_bindings.put(name, value)
+        return self._compiled_script.eval(script_bindings)
+
+_default_session = None
+
+def get_session():
+    """Return the process-wide TrackMateSession (Fiji is not started until it is used)."""
+    global _default_session
+    if _default_session is None:
+        _default_session = TrackMateSession()
+    return _default_session
+
+def java_columns(columns):
+    """Copy a Java Map of column name -> primitive array into a dict of numpy arrays (one bulk copy per column)."""
+    return {str(name): np.array(columns.get(name)) for name in columns.keySet()}
 
 def export_to_csv(data, headers, file_path):
     df = pd.DataFrame(data, columns=headers)
     df.to_csv(file_path, index=False)
 
-def run_trackmate(sequence_dir, output_dir):
-    if not os.path.isdir(sequence_dir):
-        raise FileNotFoundError(f"Input directory not found: {sequence_dir}")
-
-    folder_path = sequence_dir.replace("\\", "/")
-
-    groovy_script = f"""
-    import ij.plugin.FolderOpener;
-    import fiji.plugin.trackmate.Model;
-    import fiji.plugin.trackmate.Settings;
-    import fiji.plugin.trackmate.TrackMate;
-    import fiji.plugin.trackmate.detection.LabelImageDetectorFactory;
-    import fiji.plugin.trackmate.Logger;
-    import fiji.plugin.trackmate.providers.TrackerProvider;
-    import fiji.plugin.trackmate.features.spot.SpotShapeAnalyzerFactory;
-    import fiji.plugin.trackmate.features.spot.SpotFitEllipseAnalyzerFactory;
-    import ij.ImagePlus;
-
-    String folderPath = "{folder_path}";
-    ImagePlus imp = FolderOpener.open(folderPath, "");
-    if (imp == null) {{
-        throw new IllegalArgumentException("Failed to load the image sequence.");
-    }}
-
-    if (imp.getNFrames() == 1 && imp.getNSlices() > 1) {{
-        imp.setDimensions(1, 1, imp.getStackSize());
-    }}
-
-    Model model = new Model();
-    model.setLogger(Logger.DEFAULT_LOGGER);
-    Settings settings = new Settings().copyOn(imp);
-
-    settings.detectorFactory = new LabelImageDetectorFactory();
-    settings.detectorSettings.put("TARGET_CHANNEL", 1 as java.lang.Integer);
-    settings.detectorSettings.put("SIMPLIFY_CONTOURS", true);
-
-    settings.addSpotAnalyzerFactory(new SpotShapeAnalyzerFactory());
-    settings.addSpotAnalyzerFactory(new SpotFitEllipseAnalyzerFactory());
-
-    TrackerProvider trackerProvider = new TrackerProvider();
-    settings.trackerFactory = trackerProvider.getFactory("SPARSE_LAP_TRACKER");
-    settings.trackerSettings.put("LINKING_MAX_DISTANCE", {linking_max_distance} as java.lang.Double);
-    settings.trackerSettings.put("GAP_CLOSING_MAX_DISTANCE", {gap_closing_max_distance} as java.lang.Double);
-    settings.trackerSettings.put("ALLOW_GAP_CLOSING", true);
-    settings.trackerSettings.put("MAX_FRAME_GAP", {max_frame_gap} as java.lang.Integer);
-    settings.trackerSettings.put("ALLOW_TRACK_SPLITTING", true);
-    settings.trackerSettings.put("SPLITTING_MAX_DISTANCE", 20.0 as java.lang.Double);
-    settings.trackerSettings.put("ALLOW_TRACK_MERGING", false);
-    settings.trackerSettings.put("MERGING_MAX_DISTANCE", 20.0 as java.lang.Double);
-    settings.trackerSettings.put("ALTERNATIVE_LINKING_COST_FACTOR", 1.05 as java.lang.Double);
-    settings.trackerSettings.put("CUTOFF_PERCENTILE", 0.9 as java.lang.Double);
-    settings.trackerSettings.put("BLOCKING_VALUE", 10000.0 as java.lang.Double);
-
-    TrackMate trackmate = new TrackMate(model, settings);
-    if (!trackmate.checkInput()) {{
-        throw new IllegalArgumentException("TrackMate input check failed: " + trackmate.getErrorMessage());
-    }}
-    if (!trackmate.process()) {{
-        throw new IllegalArgumentException("TrackMate process failed: " + trackmate.getErrorMessage());
-    }}
-
-    def spotsData = [];
-    for (trackID in model.getTrackModel().trackIDs(true)) {{
-        for (spot in model.getTrackModel().trackSpots(trackID)) {{
-            def spotMap = [:];
-            spotMap['ID'] = spot.ID();
-            spotMap['TRACK_ID'] = trackID;
-            spotMap['POSITION_X'] = spot.getFeature('POSITION_X');
-            spotMap['POSITION_Y'] = spot.getFeature('POSITION_Y');
-            spotMap['POSITION_Z'] = spot.getFeature('POSITION_Z');
-            spotMap['POSITION_T'] = spot.getFeature('POSITION_T');
-            spotMap['FRAME'] = spot.getFeature('FRAME');
-            spotMap['RADIUS'] = spot.getFeature('RADIUS');
-            spotMap['AREA'] = spot.getFeature('AREA');
-            spotMap['CIRCULARITY'] = spot.getFeature('CIRCULARITY');
-            spotMap['SOLIDITY'] = spot.getFeature('SOLIDITY');
-            spotMap['ELLIPSE_ASPECTRATIO'] = spot.getFeature('ELLIPSE_ASPECTRATIO');
-            spotsData.add(spotMap);
-        }}
-    }}
-
-    def tracksData = [];
-    for (trackID in model.getTrackModel().trackIDs(true)) {{
-        def trackMap = [:];
-        trackMap['TRACK_ID'] = trackID;
-        trackMap['NUMBER_SPOTS'] = model.getTrackModel().trackSpots(trackID).size();
-        trackMap['NUMBER_SPLITS'] = model.getFeatureModel().getTrackFeature(trackID, 'NUMBER_SPLITS');
-        trackMap['NUMBER_MERGES'] = model.getFeatureModel().getTrackFeature(trackID, 'NUMBER_MERGES');
-        trackMap['TRACK_DISPLACEMENT'] = model.getFeatureModel().getTrackFeature(trackID, 'TRACK_DISPLACEMENT');
-        tracksData.add(trackMap);
-    }}
-
-    return ['spots': spotsData, 'tracks': tracksData];
+def linker_settings():
+    """The current linker constants as track_spots keyword arguments, read when called."""
+    return dict(linking_max_distance=linking_max_distance, gap_closing_max_distance=gap_closing_max_distance,
+                max_frame_gap=max_frame_gap, splitting_max_distance=splitting_max_distance)
+
+def resolve_mask_paths(sequence_dir, mask_stack=None, mask_stack_path=None, mask_paths=None):
+    """Check the tracking input and return the mask paths to read (None if a stack is given)."""
+    if mask_stack_path is not None and not os.path.isfile(mask_stack_path):
+        raise FileNotFoundError(f"Mask stack not found: {mask_stack_path}")
+    if mask_stack is None and mask_stack_path is None and mask_paths is None:
+        if not os.path.isdir(sequence_dir):
+            raise FileNotFoundError(f"Input directory not found: {sequence_dir}")
+        mask_paths = list_mask_files(sequence_dir)
+        if not mask_paths:
+            raise FileNotFoundError(f"No frame_N_mask.tif files found in: {sequence_dir}")
+    return mask_paths
+
+def lineage_from_edges(edges, spots):
+    """Return the split points: one row per daughter link of every spot with more than one successor."""
+    edges = pd.DataFrame(edges)
+    out_degree = edges["SPOT_SOURCE_ID"].map(edges["SPOT_SOURCE_ID"].value_counts())
+    splits = edges[out_degree > 1]
+    frames = pd.DataFrame(spots).set_index("ID")["FRAME"]
+    lineage = pd.DataFrame({
+        "TRACK_ID": splits["TRACK_ID"],
+        "SPLIT_FRAME": splits["SPOT_SOURCE_ID"].map(frames),
+        "MOTHER_ID": splits["SPOT_SOURCE_ID"],
+        "DAUGHTER_ID": splits["SPOT_TARGET_ID"],
+    }, columns=lineage_columns)
+    return lineage.sort_values(["TRACK_ID", "SPLIT_FRAME", "MOTHER_ID", "DAUGHTER_ID"])
+
+def export_tracking_results(spots, tracks, edges, output_dir):
+    """Write spots.csv, tracks.csv, edges.csv and the lineage.csv derived from the edges."""
+    export_to_csv(spots, spot_columns, os.path.join(output_dir, spots_csv_name))
+    export_to_csv(tracks, track_columns, os.path.join(output_dir, tracks_csv_name))
+    export_to_csv(edges, edge_columns, os.path.join(output_dir, edges_csv_name))
+    export_to_csv(lineage_from_edges(edges, spots), lineage_columns, os.path.join(output_dir, lineage_csv_name))
+
+def run_trackmate(sequence_dir, output_dir, session=None, mask_stack=None, mask_stack_path=None, mask_paths=None):
+    """Track the frame_N_mask.tif label masks in sequence_dir.
+
+    Instead of the directory, the masks can be given as an in-memory (T, Y, X) mask_stack,
+    a multi-page mask_stack_path (as written by segment_frames(stack_output=True)) or an
+    explicit list of per-frame mask_paths in frame order.
+    """
+    mask_paths = resolve_mask_paths(sequence_dir, mask_stack, mask_stack_path, mask_paths)
+
+    if session is None:
+        session = get_session()
+
+    input_imp = session.ij.py.to_imageplus(mask_stack) if mask_stack is not None else None
+    java_mask_paths = None
+    if mask_paths is not None:
+        java_mask_paths = session.ij.py.to_java([path.replace("\\", "/") for path in mask_paths])
+
+    results = session.eval_trackmate({
+        "inputImp": input_imp,
+        "stackPath": mask_stack_path.replace("\\", "/") if mask_stack_path is not None else None,
+        "maskPaths": java_mask_paths,
+        "linkingMaxDistance": float(linking_max_distance),
+        "gapClosingMaxDistance": float(gap_closing_max_distance),
+        "maxFrameGap": int(max_frame_gap),
+        "splittingMaxDistance": float(splitting_max_distance),
+    })
+
+    export_tracking_results(java_columns(results.get("spots")), java_columns(results.get("tracks")),
+                            java_columns(results.get("edges")), output_dir)
+
+def detect_mask_spots(sequence_dir, mask_stack=None, mask_stack_path=None, mask_paths=None, workers=1):
+    """Measure the spots of the masks (same inputs as run_trackmate) with spot_detection_module."""
+    mask_paths = resolve_mask_paths(sequence_dir, mask_stack, mask_stack_path, mask_paths)
+    print("[Tracking] Detecting spots in label masks")
+    if mask_stack is not None:
+        return detect_spots(mask_stack, workers)
+    if mask_stack_path is not None:
+        with MaskStackFile(mask_stack_path) as stack_file:
+            return detect_spots((stack_file[idx] for idx in range(len(stack_file))), workers)
+    return detect_spots(mask_paths, workers)
+
+def run_python_tracker(sequence_dir, output_dir, mask_stack=None, mask_stack_path=None, mask_paths=None,
+                       detection_workers=1, reuse_detections=False):
+    """Same inputs and CSV outputs as run_trackmate, tracked by lap_tracker_module without Fiji.
+
+    The untracked detections (every labelled cell with its features) are also saved as
+    detections.csv; detection_workers > 1 measures frames in a process pool. With
+    reuse_detections, an existing detections.csv in output_dir is linked again instead of
+    measuring the masks, which is all that changes when only the linking settings do.
     """
+    if reuse_detections and os.path.exists(os.path.join(output_dir, detections_csv_name)):
+        print(f"[Tracking] Reusing detections from {output_dir}")
+        detections = load_detections(output_dir)
+    else:
+        detections = detect_mask_spots(sequence_dir, mask_stack, mask_stack_path, mask_paths, detection_workers)
+        write_detections(detections, output_dir)
+
+    print(f"[Tracking] Linking {len(detections)} spots")
+    spots, tracks, edges = track_spots(detections, **linker_settings())
+    export_tracking_results(spots, tracks, edges, output_dir)
+
+def label_display_image(labels):
+    # Map label ids to distinct 8-bit gray levels (55-254) so neighbouring cells stay visible.
+    shades = (labels.astype(np.uint32) * 97) % 200 + 55
+    return np.where(labels > 0, shades, 0).astype(np.uint8)
 
-    script_engine = ij.script().getLanguageByName("Groovy").getScriptEngine()
-    results = script_engine.eval(groovy_script)
-
-    spots = results.get("spots")
-    tracks = results.get("tracks")
-
-    export_to_csv(
-        spots,
-        ["ID", "TRACK_ID", "POSITION_X", "POSITION_Y", "POSITION_Z", "POSITION_T",
-         "FRAME", "RADIUS", "CIRCULARITY", "SOLIDITY", "AREA", "ELLIPSE_ASPECTRATIO"],
-        os.path.join(output_dir, spots_csv_name)
-    )
-    export_to_csv(
-        tracks,
-        ["TRACK_ID", "NUMBER_SPOTS", "NUMBER_SPLITS", "NUMBER_MERGES", "TRACK_DISPLACEMENT"],
-        os.path.join(output_dir, tracks_csv_name)
-    )
-
-def visualize_spots(image_path, spots, output_path):
-    img = Image.open(image_path)
-    img_np = np.array(img)
+def visualize_spots(image, spots, output_path):
+    # image is either a path to a mask TIFF or an already loaded mask array
+    img_np = image if isinstance(image, np.ndarray) else np.array(Image.open(image))
+    if img_np.dtype != np.uint8:
+        img_np = label_display_image(img_np)
     img_rgb = cv2.cvtColor(img_np, cv2.COLOR_GRAY2RGB).astype(np.uint8)
 
     for spot in spots:
@@ -156,9 +366,10 @@ def visualize_spots(image_path, spots, output_path):
             )
 
     output_img = Image.fromarray(img_rgb)
-    output_img.save(output_path)
+    submit_write(output_img.save, output_path)
 
-def add_spot_visualizations(sequence_dir, output_dir, spots_csv):
+def add_spot_visualizations(sequence_dir, output_dir, spots_csv, mask_stack=None):
+    # mask_stack: anything indexable by frame (ndarray, MaskStackFile or list of mask paths); None reads frame_N_mask.tif files
     spots_df = pd.read_csv(spots_csv)
     if "FRAME" in spots_df.columns:
         spots_df["FRAME"] = spots_df["FRAME"].fillna(0).astype(int)
@@ -167,13 +378,47 @@ def add_spot_visualizations(sequence_dir, output_dir, spots_csv):
 
     for frame in range(spots_df["FRAME"].min(), spots_df["FRAME"].max() + 1):
         frame_spots = spots_df[spots_df["FRAME"] == frame].to_dict(orient="records")
-        frame_path = os.path.join(sequence_dir, f"frame_{frame+1}_mask.tif")
+        if mask_stack is not None:
+            frame_image = mask_stack[frame]
+        else:
+            frame_image = os.path.join(sequence_dir, f"frame_{frame+1}_mask.tif")
         output_path = os.path.join(output_dir, f"frame_{frame+1}_overlay.png")
-        visualize_spots(frame_path, frame_spots, output_path)
+        visualize_spots(frame_image, frame_spots, output_path)
 
-def run_trackmate_and_visualize(segmented_dir, csv_dir, overlay_dir):
-    os.makedirs(csv_dir, exist_ok=True)
+def run_tracking(sequence_dir, output_dir, session=None, mask_stack=None, mask_stack_path=None, mask_paths=None,
+                 backend="trackmate", detection_workers=1, reuse_detections=False, time_window=None,
+                 window_overlap=20):
+    """Track the masks (same inputs as run_trackmate) with backend "trackmate" (Fiji) or "python" (no JVM).
+
+    With time_window, the movie is tracked in overlapping windows of that many frames
+    (chunked_tracking_module), with detection_workers windows at a time for the python backend.
+    """
+    if backend not in tracking_backends:
+        raise ValueError(f"Unknown tracking backend: {backend} (expected one of {tracking_backends})")
+    os.makedirs(output_dir, exist_ok=True)
+    if time_window is not None:
+        from chunked_tracking_module import run_chunked_tracking  # Deferred: it imports this module
+        run_chunked_tracking(sequence_dir, output_dir, time_window, window_overlap, backend, session, mask_stack,
+                             mask_stack_path, mask_paths, detection_workers)
+    elif backend == "python":
+        run_python_tracker(sequence_dir, output_dir, mask_stack, mask_stack_path, mask_paths, detection_workers,
+                           reuse_detections)
+    else:
+        run_trackmate(sequence_dir, output_dir, session, mask_stack, mask_stack_path, mask_paths)
+
+def run_trackmate_and_visualize(segmented_dir, csv_dir, overlay_dir, session=None, mask_stack=None,
+                                mask_stack_path=None, mask_paths=None, backend="trackmate", detection_workers=1,
+                                reuse_detections=False, time_window=None, window_overlap=20):
+    """Track the masks with run_tracking and draw the spots."""
+    run_tracking(segmented_dir, csv_dir, session, mask_stack, mask_stack_path, mask_paths, backend,
+                 detection_workers, reuse_detections, time_window, window_overlap)
     os.makedirs(overlay_dir, exist_ok=True)
-    run_trackmate(segmented_dir, csv_dir)
     spots_csv_path = os.path.join(csv_dir, spots_csv_name)
-    add_spot_visualizations(segmented_dir, overlay_dir, spots_csv_path)
\ No newline at end of file
+    if mask_stack is None and mask_paths is not None:
+        # visualize_spots accepts paths, so the list can stand in for a stack
+        add_spot_visualizations(segmented_dir, overlay_dir, spots_csv_path, mask_paths)
+    elif mask_stack is None and mask_stack_path is not None:
+        with MaskStackFile(mask_stack_path) as stack_file:
+            add_spot_visualizations(segmented_dir, overlay_dir, spots_csv_path, stack_file)
+    else:
+        add_spot_visualizations(segmented_dir, overlay_dir, spots_csv_path, mask_stack)
\ No newline at end of file
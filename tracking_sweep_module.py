@@ -0,0 +1,95 @@
+# tracking_sweep_module.py
+
+import os
+import sys
+import itertools
+import pandas as pd
+import tracking_module
+from lap_tracker_module import track_spots
+from spot_detection_module import load_detections
+from process_pool_module import spawn_pool
+from post_tracking_module import TrackLineage, classify_tracks, classification_percentages
+
+sweep_csv_name = "linker_sweep.csv"
+linker_parameters = ("linking_max_distance", "gap_closing_max_distance", "max_frame_gap", "splitting_max_distance")
+classification_labels = ("Y", "N", "T1F", "T2F", "NaN")
+
+def current_linker_config():
+    """The linker settings tracking_module currently uses."""
+    return {name: getattr(tracking_module, name) for name in linker_parameters}
+
+def linker_config_grid(**options):
+    """All combinations of the given parameter values, e.g. linker_config_grid(max_frame_gap=[2, 5]).
+
+    Parameters that are not given keep their current tracking_module value.
+    """
+    unknown = set(options) - set(linker_parameters)
+    if unknown:
+        raise ValueError(f"Unknown linker parameters: {sorted(unknown)}")
+    base = current_linker_config()
+    names = list(options)
+    return [dict(base, **dict(zip(names, values))) for values in itertools.product(*options.values())]
+
+_sweep_detections = None
+
+def _init_sweep_worker(detections):
+    # The detections are sent to each worker once, not with every configuration
+    global _sweep_detections
+    _sweep_detections = detections
+
+def _evaluate_config(config):
+    spots, tracks, edges = track_spots(_sweep_detections, **config)
+    rates = {}
+    if len(tracks):
+        lineage = TrackLineage(tracking_module.lineage_from_edges(edges, spots), edges, spots)
+        _, classification_results = classify_tracks(spots, tracks, lineage)
+        rates = classification_percentages(classification_results)
+    row = dict(config, tracks=len(tracks), splits=int(tracks["NUMBER_SPLITS"].sum()) if len(tracks) else 0)
+    for label in classification_labels:
+        row[f"Rate {label}"] = rates.get(label, 0.0)
+    return row
+
+def sweep_linker_configs(detections, configs, workers=1, output_path=None):
+    """Link the same detections under every config and compare the classification rates.
+
+    detections is a detections table (or the tracking CSV directory holding detections.csv),
+    so the masks are measured only once. The first config is the baseline: every row also
+    gets "Delta Rate X" columns, its rates minus the baseline's, in percentage points.
+    Configs run in a process pool when workers > 1.
+    """
+    if isinstance(detections, str):
+        detections = load_detections(detections)
+    if not configs:
+        raise ValueError("No linker configurations to sweep")
+
+    print(f"[Sweep] Linking {len(detections)} detections under {len(configs)} configurations")
+    if workers > 1:
+        with spawn_pool(workers, _init_sweep_worker, (detections,)) as executor:
+            rows = list(executor.map(_evaluate_config, configs))
+    else:
+        _init_sweep_worker(detections)
+        rows = [_evaluate_config(config) for config in configs]
+
+    results = pd.DataFrame(rows)
+    for label in classification_labels:
+        results[f"Delta Rate {label}"] = results[f"Rate {label}"] - results[f"Rate {label}"].iloc[0]
+
+    if output_path is not None:
+        results.to_csv(output_path, index=False)
+        print(f"[Sweep] Saved results to {output_path}")
+    for row in results.to_dict("records"):
+        print(f"[Sweep] linking={row['linking_max_distance']} gap={row['gap_closing_max_distance']} "
+              f"frame_gap={row['max_frame_gap']} splitting={row['splitting_max_distance']}: {row['tracks']} tracks, "
+              f"Rate Y {row['Rate Y']:.2f}% ({row['Delta Rate Y']:+.2f})")
+    return results
+
+if __name__ == "__main__":
+    # Sweep around the current settings using the detections of the last python-backend run
+    csv_dir = sys.argv[1] if len(sys.argv) > 1 else "output/tracking_csv"
+    base = current_linker_config()
+    configs = [base] + [config for config in linker_config_grid(
+        linking_max_distance=[0.5 * base["linking_max_distance"], base["linking_max_distance"],
+                              1.5 * base["linking_max_distance"]],
+        max_frame_gap=[1, 2, base["max_frame_gap"]]) if config != base]
+    sweep_linker_configs(csv_dir, configs, workers=os.cpu_count() or 1,
+                         output_path=os.path.join(csv_dir, sweep_csv_name))
@@ -0,0 +1,84 @@
+# writer_module.py
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+# Defaults for background_writes()
+writer_threads = 2
+max_pending_writes = 16
+
+class BackgroundWriter:
+    """Runs output writes on a small thread pool so computation can overlap with disk I/O.
+
+    submit() blocks once max_pending writes are queued or running (backpressure), which
+    bounds the memory held by queued images. flush() waits for everything submitted so far
+    and re-raises the first write error.
+    """
+
+    def __init__(self, threads=writer_threads, max_pending=max_pending_writes):
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="writer")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._errors = []
+
+    def submit(self, fn, *args, **kwargs):
+        self._slots.acquire()
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            if future.exception() is not None:
+                self._errors.append(future.exception())
+        self._slots.release()
+
+    def flush(self):
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending)
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            print(f"[Writer] {len(errors)} write(s) failed")
+            raise errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+# Writer that submit_write() hands work to; None means writes happen synchronously
+_active_writer = None
+
+def submit_write(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on the active BackgroundWriter, or right away if there is none.
+
+    The arguments must not be modified after submission.
+    """
+    if _active_writer is None:
+        fn(*args, **kwargs)
+    else:
+        _active_writer.submit(fn, *args, **kwargs)
+
+def flush_writes():
+    """Wait for all background writes so far (e.g. before the next stage reads them back)."""
+    if _active_writer is not None:
+        _active_writer.flush()
+
+@contextmanager
+def background_writes(threads=writer_threads, max_pending=max_pending_writes):
+    """Send submit_write() calls made inside the block to a BackgroundWriter, flushing on exit."""
+    global _active_writer
+    writer = BackgroundWriter(threads, max_pending)
+    previous, _active_writer = _active_writer, writer
+    try:
+        yield writer
+    finally:
+        _active_writer = previous
+        writer.close()